@@ -7,6 +7,31 @@ from models import Case  # Add this import
 
 logger = logging.getLogger(__name__)
 
+def write_excel(df, path, sheet_name='Sheet1'):
+    """按行流式写出 Excel（xlsxwriter constant_memory 模式），内存占用不随行数增长
+
+    pandas 的 to_excel 按列写单元格，与 constant_memory 要求的逐行写入不兼容，
+    因此这里直接用 xlsxwriter 的 write_row；未安装 xlsxwriter 时回退到 to_excel。
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        df.to_excel(path, index=False, sheet_name=sheet_name)
+        return
+
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'strings_to_urls': False,  # 网址列按普通文本写入，避免超链接数量上限
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns])
+        for row_no, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(row_no, 0, [None if pd.isna(value) else value for value in row])
+    finally:
+        workbook.close()
+
 class DataExporter:
     def __init__(self, db_session):
         self.db_session = db_session
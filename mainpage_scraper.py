@@ -82,8 +82,9 @@ async def main():
                 
                 logger.info(f"第 {target_page} 页获取到 {len(cases)} 个案件")
                 
-                # 处理每个案件
+                # 处理每个案件，解析结果先收集起来，整页批量写入数据库
                 page_success = 0
+                pending = []
                 for case in cases:
                     try:
                         total_processed += 1
@@ -91,7 +92,7 @@ async def main():
                         logger.info(f"当前页进度: {page_success + 1}/{len(cases)}")
                         
                         # 处理案件详情
-                        result = await scraper.process_case(case)
+                        result = await scraper.process_case(case, pending)
                         if result:
                             total_success += 1
                             page_success += 1
@@ -103,6 +104,9 @@ async def main():
                         logger.error(f"处理案件时发生错误: {str(e)}")
                         continue
                 
+                if pending and not await scraper.save_many_to_db(pending):
+                    logger.error(f"第 {target_page} 页批量保存失败，共 {len(pending)} 个案件未写入数据库")
+                
                 logger.info(f"第 {target_page} 页处理完成，成功: {page_success}/{len(cases)}")
                 logger.info(f"总进度: {pages_processed}/{total_pages} 页 ({(pages_processed/total_pages*100):.1f}%)")
                 
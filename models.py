@@ -1,8 +1,74 @@
-from sqlalchemy import create_engine, Column, Integer, String, Date, DateTime
+from sqlalchemy import create_engine, event, text, Column, Integer, String, Date, DateTime
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.exc import IntegrityError
+import logging
 from datetime import datetime
 
 Base = declarative_base()
+logger = logging.getLogger(__name__)
+
+# 每个新连接上执行的 SQLite 性能参数：WAL 日志 + NORMAL 同步，锁冲突时等待 5 秒，临时表放内存，加大页缓存并启用 mmap
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+)
+
+def apply_sqlite_pragmas(dbapi_connection):
+    """在原生 sqlite3 连接上执行性能 PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+def _ensure_unique_index(engine, name, column, label):
+    """优先创建唯一索引；库中已有重复值时退化为普通索引，返回最终是否为唯一索引"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON cases({column})"))
+    except IntegrityError:
+        logger.warning(f"数据库中存在重复的{label}，改为创建普通索引")
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON cases({column})"))
+        return False
+    # 索引可能由之前的运行以普通索引形式创建过
+    with engine.connect() as conn:
+        return any(row[1] == name and row[2] for row in conn.execute(text("PRAGMA index_list(cases)")))
+
+def ensure_indexes(engine):
+    """按案件名称、来源网址查询时走索引而不是全表扫描
+
+    Returns:
+        bool: case_name 上的索引是否为唯一索引
+    """
+    # 各写入方按 case_name 去重，同一网址可能对应改名前后的多条记录，source_url 只能是普通索引
+    with engine.begin() as conn:
+        if any(row[1] == 'idx_cases_source_url' and row[2] for row in conn.execute(text("PRAGMA index_list(cases)"))):
+            # 之前的运行可能已创建为唯一索引
+            conn.execute(text("DROP INDEX idx_cases_source_url"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_cases_source_url ON cases(source_url)"))
+    return _ensure_unique_index(engine, 'idx_cases_case_name', 'case_name', '案件名称')
+
+def enable_sqlite_pragmas(engine):
+    """为引擎注册连接事件，使每个新连接都应用性能 PRAGMA"""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection)
+    return engine
+
+def enable_sqlite_savepoints(engine):
+    """让 SAVEPOINT (begin_nested) 在 pysqlite 下正常工作：关闭驱动自带的事务处理，由 SQLAlchemy 显式发出 BEGIN"""
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+    return engine
 
 class Case(Base):
     __tablename__ = 'cases'
@@ -14,4 +80,12 @@ class Case(Base):
     source_url = Column(String)
     region = Column(String)  # Add region column
     attachment_path = Column(String)
-    created_at = Column(DateTime, default=datetime.now)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.now)
+
+class DownloadedAttachment(Base):
+    """已成功下载的附件 URL，重复爬取时据此跳过下载"""
+    __tablename__ = 'downloaded_attachments'
+
+    url = Column(String, primary_key=True)
+    file_path = Column(String)
+    downloaded_at = Column(DateTime, default=datetime.now)
@@ -4,28 +4,89 @@ import time
 import pandas as pd
 from datetime import datetime
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
-from models import Case, Base
+from models import Case, Base, ensure_indexes
 from config import CONFIG
 import logging
 from downloader import AttachmentDownloader
 from exporter import DataExporter
-from utils import PageTypeIdentifier
+from utils import PageTypeIdentifier, FileHandler
 from parsers import create_parser, BeijingParser, ShanghaiParser, ChongqingParser, GuangdongParser, ShaanxiParser, SamrParser
 from playwright.sync_api import sync_playwright
 from playwright.async_api import async_playwright
 from urllib.parse import urljoin
 import asyncio
+import csv
 import urllib.parse
 import aiohttp
 import aiofiles
 import sqlite3
-from sqlalchemy.sql import text
+from sqlalchemy.sql import text, bindparam
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# 案件读写语句在模块加载时构造一次，各方法直接复用
+_SELECT_CASE = text("SELECT id FROM cases WHERE case_name = :case_name")
+
+_SELECT_CASE_ATTACHMENT = text("SELECT id, attachment_path FROM cases WHERE case_name = :case_name")
+
+_SELECT_CURRENT = text("""
+    SELECT notice_start_date, notice_end_date, region 
+    FROM cases 
+    WHERE case_name = :case_name
+""")
+
+_SELECT_EXISTING_NAMES = text(
+    "SELECT case_name FROM cases WHERE case_name IN :names"
+).bindparams(bindparam('names', expanding=True))
+
+# 更新已存在案件：只在当前值为空且新值不为空时更新
+_UPDATE_CASE = text("""
+    UPDATE cases 
+    SET notice_start_date = CASE 
+            WHEN notice_start_date IS NULL AND :notice_start_date IS NOT NULL 
+            THEN :notice_start_date 
+            ELSE notice_start_date 
+        END,
+        notice_end_date = CASE 
+            WHEN notice_end_date IS NULL AND :notice_end_date IS NOT NULL 
+            THEN :notice_end_date 
+            ELSE notice_end_date 
+        END,
+        region = CASE 
+            WHEN (region IS NULL OR region = '') AND :region != '' 
+            THEN :region 
+            ELSE region 
+        END
+    WHERE case_name = :case_name
+""")
+
+# 插入新案件记录
+_INSERT_CASE = text("""
+    INSERT INTO cases (
+        case_name, source_url, attachment_path, region,
+        notice_start_date, notice_end_date, created_at
+    ) VALUES (
+        :case_name, :source_url, :attachment_path, :region,
+        :notice_start_date, :notice_end_date, CURRENT_TIMESTAMP
+    )
+""")
+
+# 导出文件的表头与数据库字段对应关系
+_EXPORT_COLUMNS = [
+    ('案件名称', 'case_name'),
+    ('公示开始日期', 'notice_start_date'),
+    ('公示结束日期', 'notice_end_date'),
+    ('来源网址', 'source_url'),
+    ('附件路径', 'attachment_path'),
+    ('地区', 'region'),
+    ('爬取时间', 'created_at'),
+]
+
+_EXPORT_SQL = f"SELECT {', '.join(column for _, column in _EXPORT_COLUMNS)} FROM cases"
+
 class SamrScraper:
     def __init__(self):
         self.session = requests.Session()
@@ -88,12 +149,8 @@ class SamrScraper:
             download_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'attachments')
             os.makedirs(download_path, exist_ok=True)
             
-            # 获取文件扩展名
-            file_ext = '.doc'  # 默认扩展名
-            if url.lower().endswith('.docx'):
-                file_ext = '.docx'
-            elif url.lower().endswith('.pdf'):
-                file_ext = '.pdf'
+            # 获取文件扩展名（默认 .doc）
+            file_ext = FileHandler.get_file_extension(url)
             
             # 构建文件名（使用案件名称）
             file_name = f"{safe_title}{file_ext}"
@@ -137,28 +194,14 @@ class SamrScraper:
     async def export_to_excel(self):
         """导出数据到Excel"""
         try:
-            # 获取所有案件数据
-            cases = self.db_session.query(Case).all()
-            
-            # 准备数据
+            # 分批读取所有案件数据（返回普通元组，不构造ORM对象）
+            stmt = select(*(getattr(Case, name) for _, name in _EXPORT_COLUMNS)).execution_options(yield_per=500)
             data = []
-            for case in cases:
-                data.append({
-                    '案件名称': case.title,
-                    '案件类型': case.case_type,
-                    '案件状态': case.status,
-                    '立案日期': case.filing_date,
-                    '结案日期': case.closing_date,
-                    '案件链接': case.url,
-                    '案件来源': case.source,
-                    '案件地区': case.region,
-                    '案件描述': case.description,
-                    '附件链接': case.attachment_url,
-                    '更新时间': case.updated_at
-                })
-            
-            # 创建DataFrame
-            df = pd.DataFrame(data)
+            for chunk in self.db_session.execute(stmt).partitions(500):
+                data.extend(chunk)
+            
+            # 创建DataFrame（仅用于Excel）
+            df = pd.DataFrame(data, columns=[header for header, _ in _EXPORT_COLUMNS])
             
             # 生成文件名
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -169,8 +212,17 @@ class SamrScraper:
             df.to_excel(excel_path, index=False, engine='openpyxl')
             logging.info(f"数据已导出到Excel: {excel_path}")
             
-            # 保存为CSV
-            df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+            # 保存为CSV：直接从数据库游标流式写出，不经过DataFrame
+            conn = self.engine.raw_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(_EXPORT_SQL)
+                with open(csv_path, 'w', encoding='utf-8-sig', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow([header for header, _ in _EXPORT_COLUMNS])
+                    writer.writerows(cursor)
+            finally:
+                conn.close()
             logging.info(f"数据已导出到CSV: {csv_path}")
             
             return True
@@ -226,32 +278,59 @@ class CaseScraper:
         self.playwright = None
         self.context = None
         self.page = None
+        self.http = None
         self.current_page = None
         self.engine = None
         self.logger = logging.getLogger(__name__)
-        self.setup_database()
         
         # 创建必要的目录
         os.makedirs('data/attachments', exist_ok=True)
         os.makedirs('data/exports', exist_ok=True)
+        
+        self.setup_database()
 
     async def __aenter__(self):
         """异步上下文管理器的进入方法"""
         self.logger.info("初始化 Playwright...")
         self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch()
-        self.context = await self.browser.new_context(
+        # 使用持久化上下文，缓存和cookie在多次运行之间保留
+        self.context = await self.playwright.chromium.launch_persistent_context(
+            user_data_dir='data/.pw-cache',
             viewport={'width': 1920, 'height': 1080},
             user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
         )
-        self.page = await self.context.new_page()
+        # 只需要页面文本，拦截图片、字体、样式等资源
+        await self.context.route('**/*', self._block_static_resources)
+        self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
         self.page.set_default_timeout(180000)  # 设置超时时间为180秒
         self.logger.info("Playwright 初始化完成")
+        
+        # 详情页共用一个 aiohttp 会话，复用连接且不阻塞事件循环
+        self.http = aiohttp.ClientSession(
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1'
+            },
+            connector=aiohttp.TCPConnector(ssl=False)  # 与原 verify=False 行为一致
+        )
         return self
 
+    @staticmethod
+    async def _block_static_resources(route):
+        """Playwright路由处理：中止图片、字体、样式表和媒体请求"""
+        if route.request.resource_type in ('image', 'font', 'stylesheet', 'media'):
+            await route.abort()
+        else:
+            await route.continue_()
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         """异步上下文管理器的退出方法"""
         self.logger.info("清理 Playwright 资源...")
+        if self.http:
+            await self.http.close()
         if self.page:
             await self.page.close()
         if self.context:
@@ -261,23 +340,24 @@ class CaseScraper:
         if self.playwright:
             await self.playwright.stop()
         self.logger.info("Playwright 资源清理完成")
+        
+        # 让SQLite根据本次运行的查询更新统计信息
+        try:
+            with self.engine.connect() as conn:
+                conn.execute(text("PRAGMA optimize"))
+        except Exception as e:
+            self.logger.warning(f"执行 PRAGMA optimize 失败: {str(e)}")
 
     async def fetch_page(self, url):
-        """使用requests获取页面内容"""
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1'
-        }
+        """使用共享的aiohttp会话获取页面内容"""
+        if not self.http:
+            self.logger.error("aiohttp 会话未初始化")
+            return None
         
         try:
-            # 使用aiohttp或requests
-            response = requests.get(url, headers=headers, verify=False)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
-            return response.text
+            async with self.http.get(url) as response:
+                response.raise_for_status()
+                return await response.text(encoding=response.charset or 'utf-8')
         except Exception as e:
             self.logger.error(f"获取页面失败: {str(e)}")
             return None
@@ -304,7 +384,8 @@ class CaseScraper:
                     self.logger.info(f"首次访问页面: {url}")
                     try:
                         await self.page.goto(url, wait_until='domcontentloaded', timeout=180000)
-                        await asyncio.sleep(5)
+                        # 等待列表渲染完成，替代固定等待
+                        await self.page.wait_for_selector('.content-3-left-text a', timeout=180000)
                         self.current_page = 1
                         self.logger.info(f"初始化当前页码为: {self.current_page}")
                     except Exception as e:
@@ -320,7 +401,6 @@ class CaseScraper:
                             success = await self._turn_to_next_page()
                             if not success:  # 如果翻页失败
                                 return None
-                            await asyncio.sleep(2)  # 翻页后短暂等待
                 
                 # 第二种情况：从当前页继续翻一页
                 elif page_no > self.current_page:
@@ -397,7 +477,7 @@ class CaseScraper:
             logger.info(f"页面类型: {page_type}, 地区: {region}")
             
             # 解析页面内容
-            result = self.parse_detail_page(html_content, url)
+            result = self.parse_detail_page(html_content, url, page_type)
             if not result:
                 logger.error("页面解析失败")
                 return None
@@ -413,14 +493,21 @@ class CaseScraper:
             logger.error(f"处理案件页面失败: {str(e)}")
             return None
             
-    def parse_detail_page(self, html_content, source_url):
-        """解析详情页面"""
+    def parse_detail_page(self, html_content, source_url, page_type=None):
+        """解析详情页面
+        
+        Args:
+            html_content: 页面HTML
+            source_url: 页面URL
+            page_type: 调用方已识别的页面类型，为空时根据URL识别
+        """
         try:
             # 使用BeautifulSoup解析HTML
             soup = BeautifulSoup(html_content, 'html.parser')
             
             # 识别页面类型
-            page_type = PageTypeIdentifier.identify_page_type(source_url)
+            if not page_type:
+                page_type = PageTypeIdentifier.identify_page_type(source_url)
             if not page_type:
                 logger.error(f"无法识别页面类型: {source_url}")
                 return None
@@ -456,12 +543,8 @@ class CaseScraper:
             download_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'attachments')
             os.makedirs(download_path, exist_ok=True)
             
-            # 获取文件扩展名
-            file_ext = '.doc'  # 默认扩展名
-            if url.lower().endswith('.docx'):
-                file_ext = '.docx'
-            elif url.lower().endswith('.pdf'):
-                file_ext = '.pdf'
+            # 获取文件扩展名（默认 .doc）
+            file_ext = FileHandler.get_file_extension(url)
             
             # 构建文件名（使用案件名称）
             file_name = f"{safe_title}{file_ext}"
@@ -502,70 +585,42 @@ class CaseScraper:
             logger.error(f"下载附件时发生错误: {str(e)}")
             return None
 
+    def _build_db_data(self, case_data):
+        """准备要保存到数据库的字段"""
+        return {
+            'case_name': case_data.get('title', case_data.get('case_name')),
+            'source_url': case_data.get('url', case_data.get('source_url')),
+            'attachment_path': case_data.get('attachment_path'),
+            'region': case_data.get('region', ''),
+            'notice_start_date': case_data.get('notice_start_date'),
+            'notice_end_date': case_data.get('notice_end_date')
+        }
+
     async def save_to_db(self, case_data):
         """保存案件数据到数据库"""
         try:
             # 准备要保存的数据
-            db_data = {
-                'case_name': case_data.get('title', case_data.get('case_name')),
-                'source_url': case_data.get('url', case_data.get('source_url')),
-                'attachment_path': case_data.get('attachment_path'),
-                'region': case_data.get('region', ''),
-                'notice_start_date': case_data.get('notice_start_date'),
-                'notice_end_date': case_data.get('notice_end_date')
-            }
+            db_data = self._build_db_data(case_data)
 
             # 检查案件是否已存在
             result = self.session.execute(
-                text("SELECT id FROM cases WHERE case_name = :case_name"),
+                _SELECT_CASE,
                 {"case_name": db_data['case_name']}
             ).fetchone()
             
             if result:
                 # 首先获取当前记录的值
                 current_record = self.session.execute(
-                    text("""
-                        SELECT notice_start_date, notice_end_date, region 
-                        FROM cases 
-                        WHERE case_name = :case_name
-                    """),
+                    _SELECT_CURRENT,
                     {"case_name": db_data['case_name']}
                 ).fetchone()
                 
                 # 只在当前值为空且新值不为空时更新
-                update_sql = """
-                    UPDATE cases 
-                    SET notice_start_date = CASE 
-                            WHEN notice_start_date IS NULL AND :notice_start_date IS NOT NULL 
-                            THEN :notice_start_date 
-                            ELSE notice_start_date 
-                        END,
-                        notice_end_date = CASE 
-                            WHEN notice_end_date IS NULL AND :notice_end_date IS NOT NULL 
-                            THEN :notice_end_date 
-                            ELSE notice_end_date 
-                        END,
-                        region = CASE 
-                            WHEN (region IS NULL OR region = '') AND :region != '' 
-                            THEN :region 
-                            ELSE region 
-                        END
-                    WHERE case_name = :case_name
-                """
-                self.session.execute(text(update_sql), db_data)
+                self.session.execute(_UPDATE_CASE, db_data)
                 self.logger.info(f"更新已存在的案件记录: {db_data['case_name']}")
             else:
                 # 创建新记录
-                insert_sql = """
-                    INSERT INTO cases (
-                        case_name, source_url, attachment_path, region,
-                        notice_start_date, notice_end_date, created_at
-                    ) VALUES (
-                        :case_name, :source_url, :attachment_path, :region,
-                        :notice_start_date, :notice_end_date, CURRENT_TIMESTAMP
-                    )
-                """
-                self.session.execute(text(insert_sql), db_data)
+                self.session.execute(_INSERT_CASE, db_data)
                 self.logger.info(f"插入新案件记录: {db_data['case_name']}")
             
             self.session.commit()
@@ -578,6 +633,48 @@ class CaseScraper:
             self.logger.error(f"保存案件到数据库失败: {case_data.get('title', case_data.get('case_name'))}")
             return False
 
+    async def save_many_to_db(self, cases):
+        """批量保存一页案件数据到数据库
+
+        一次查询区分新旧案件，再分别以参数列表执行 UPDATE / INSERT（executemany），
+        整页只提交一次。
+
+        Returns:
+            int: 成功保存的案件数
+        """
+        if not cases:
+            return 0
+
+        try:
+            # 同一页内同名案件只保留最后一条
+            rows = {}
+            for case_data in cases:
+                db_data = self._build_db_data(case_data)
+                rows[db_data['case_name']] = db_data
+
+            existing = {
+                row[0] for row in self.session.execute(
+                    _SELECT_EXISTING_NAMES,
+                    {"names": list(rows)}
+                )
+            }
+            updates = [db_data for name, db_data in rows.items() if name in existing]
+            inserts = [db_data for name, db_data in rows.items() if name not in existing]
+
+            if updates:
+                self.session.execute(_UPDATE_CASE, updates)
+            if inserts:
+                self.session.execute(_INSERT_CASE, inserts)
+
+            self.session.commit()
+            self.logger.info(f"批量保存 {len(rows)} 个案件到数据库 (新增 {len(inserts)}，更新 {len(updates)})")
+            return len(rows)
+
+        except Exception as e:
+            self.session.rollback()
+            self.logger.error(f"批量保存案件到数据库失败: {str(e)}")
+            return 0
+
     def export_data(self):
         """导出数据到Excel"""
         try:
@@ -640,20 +737,8 @@ class CaseScraper:
             return None
 
     def get_page_type(self, url):
-        """根据URL确定页面类型"""
-        domain_map = {
-            'scjgj.beijing.gov.cn': 'beijing',
-            'scjgj.sh.gov.cn': 'shanghai',
-            'scjgj.cq.gov.cn': 'chongqing',
-            'amr.gd.gov.cn': 'guangdong',
-            'scjgj.shaanxi.gov.cn': 'shaanxi',
-            'samr.gov.cn': 'samr'
-        }
-        
-        for domain, page_type in domain_map.items():
-            if domain in url:
-                return page_type
-        return None
+        """根据URL确定页面类型（与 PageTypeIdentifier 共用同一张域名表）"""
+        return PageTypeIdentifier.identify_page_type(url)
 
     def get_region_name(self, page_type):
         """获取地区名称"""
@@ -667,8 +752,13 @@ class CaseScraper:
         }
         return region_map.get(page_type, '未知')
 
-    async def process_case(self, case_data):
-        """处理单个案件"""
+    async def process_case(self, case_data, pending=None):
+        """处理单个案件
+
+        Args:
+            case_data: 列表页中的案件信息
+            pending: 可选的待保存列表；提供时只收集案件数据，由调用方按页调用 save_many_to_db 批量写入
+        """
         try:
             # 获取案件详情页面内容
             html_content = await self.fetch_page(case_data['url'])
@@ -694,7 +784,7 @@ class CaseScraper:
                 
             # 检查数据库中是否已存在
             result = self.session.execute(
-                text("SELECT id, attachment_path FROM cases WHERE case_name = :case_name"),
+                _SELECT_CASE_ATTACHMENT,
                 {"case_name": case_detail.get('case_name')}
             ).fetchone()
             
@@ -722,6 +812,10 @@ class CaseScraper:
             case_data.update(case_detail)
             case_data['region'] = self.get_region_name(page_type)
             
+            if pending is not None:
+                pending.append(case_data)
+                return case_data
+            
             # 保存到数据库
             save_result = await self.save_to_db(case_data)
             if not save_result:
@@ -738,6 +832,8 @@ class CaseScraper:
     def setup_database(self):
         """设置数据库连接"""
         self.engine = create_engine(f"sqlite:///data/cases.db")
+        Base.metadata.create_all(self.engine)
+        ensure_indexes(self.engine)
         self.session = sessionmaker(bind=self.engine)()
 
     async def _turn_to_next_page(self):
@@ -762,10 +858,13 @@ class CaseScraper:
                 return False
             
             await next_button.click()
-            await asyncio.sleep(3)  # 等待页面加载
             
-            # 等待新内容加载
-            await self.page.wait_for_selector('.content-3-left-text', timeout=180000)
+            # 等待列表第一个标题变化，新内容一出现即继续
+            await self.page.wait_for_function(
+                "(old) => { const a = document.querySelector('.content-3-left-text a'); return a && a.innerText !== old; }",
+                arg=first_title,
+                timeout=180000  # 与原先等待列表渲染的上限保持一致，慢速渲染时不至于超时
+            )
             new_element = await self.page.query_selector('.content-3-left-text a')
             if not new_element:
                 self.logger.error("翻页后未找到新的标题元素")
@@ -1,17 +1,123 @@
 import os
 import logging
 import requests
-from bs4 import BeautifulSoup
+import aiohttp
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, UnicodeDammit
 from datetime import datetime
 import re
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, func, insert, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
-from models import Case, Base
-from urllib.parse import urljoin, urlparse, unquote
+from exporter import write_excel
+from models import Case, DownloadedAttachment, Base, enable_sqlite_pragmas, enable_sqlite_savepoints, ensure_indexes
+from urllib.parse import urljoin, urlsplit, unquote
 import pandas as pd
 import asyncio
 import traceback
-import sqlite3
+import hashlib
+import json
+
+# 优先使用 lxml 解析器（C 实现，速度快），未安装时回退到内置的 html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# 列表页只需简单的 CSS 查询，优先使用 selectolax (lexbor)，未安装时回退到 BeautifulSoup
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# urllib3 只有在安装了 brotli 时才能解压 br 响应，否则只声明 gzip/deflate
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# 详情页并发抓取上限，以及需要退避重试的状态码
+DETAIL_CONCURRENCY = 16
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 附件下载的分块大小
+ATTACHMENT_CHUNK_SIZE = 1 << 20
+
+# 导出 Excel 时从数据库读取的列，别名即 Excel 表头
+_EXPORT_SQL = (
+    "SELECT case_name AS 案件名称, notice_start_date AS 公示开始日期, notice_end_date AS 公示结束日期, "
+    "source_url AS 来源网址, attachment_path AS 附件路径, region AS 地区, created_at AS 爬取时间 FROM cases"
+)
+
+# 文件名非法字符替换为下划线
+_BAD_CHARS_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '_'))
+
+# 列表页分页区域中的“下一页”链接
+_NEXT_PAGE_SELECTOR = 'a.next, a[title="下一页"]'
+
+def _usable_href(href):
+    """过滤掉 javascript: 和 # 这类不能直接访问的链接"""
+    if not href or href.startswith('#') or href.lower().startswith('javascript:'):
+        return None
+    return href
+
+# 预编译的正则：公示期日期范围、文件后缀
+_DATE_RE = re.compile(r'公\s*示\s*期\s*[:：]?\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})\s*日?\s*[至到-]\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})日?')
+_EXT_RE = re.compile(r'\.([a-zA-Z0-9]+)$')
+_ATTACH_HREF_RE = re.compile(r'\.(?:docx?|pdf|xlsx?|zip|rar|txt)(?:$|[?#])', re.I)
+_ATTACH_KEYWORD_RE = re.compile(r'公示表|附件|下载')
+_HEADER_CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
+_LIST_DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2})\s*$')
+
+def _safe_name(url, case_name):
+    """由附件 URL 得到本地文件名；URL 中取不到有效文件名时用案件名称加 URL 后缀生成"""
+    # 先整体解码再取最后一段，避免 %2F / %5C 解码出路径分隔符导致目录穿越
+    file_name = os.path.basename(unquote(urlsplit(url).path).replace('\\', '/'))
+    if file_name in ('.', '..'):
+        file_name = ''
+    file_name = file_name.translate(_BAD_CHARS_TABLE)
+
+    # 如果无法从URL有效获取文件名，或文件名看起来不正常（如太短、无后缀）
+    # 则尝试基于 case_name 和 URL 后缀构建
+    if '.' not in file_name or len(file_name) < 5:
+        ext_match = _EXT_RE.search(url.lower())
+        ext = ext_match.group(1) if ext_match else 'bin' # 默认后缀
+        # 清理case_name作为文件名，并限制长度
+        file_name = f"{case_name.translate(_BAD_CHARS_TABLE)[:100]}.{ext}"
+        logger.warning(f"无法从URL解析有效文件名，使用生成的文件名: {file_name}")
+    return file_name
+
+def _changed(old, new):
+    """逐元素比较两列：一方为空另一方不为空，或两者均非空且不相等"""
+    changed = (old.isna() != new.isna()) | (old.notna() & new.notna() & (old != new))
+    # string 等可空类型比较时会产生 NA，统一转为普通布尔掩码
+    return changed.fillna(False).astype(bool)
+
+def _to_datetime_cached(col):
+    """把 Excel 读出的日期列转为 datetime：已是 datetime 类型直接返回，否则只解析去重后的值再映射回各行
+
+    列中可能同时有纯日期和带时间的值，使用 format='mixed' 逐值识别格式，避免按首个值推断后其余格式变成 NaT。
+    """
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col
+    uniques = col.dropna().unique()
+    parsed = pd.Series(pd.to_datetime(uniques, errors='coerce', format='mixed'), index=uniques)
+    return pd.to_datetime(col.map(parsed), errors='coerce')
+
+def _load_export_state(path):
+    """读取上次导出时记录的数据库哈希、总记录数和Excel修改时间，不存在或损坏时返回 None"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_export_state(path, state):
+    """保存本次导出的数据库哈希、总记录数和Excel修改时间"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -23,45 +129,47 @@ class ShaanxiScraper:
         self.base_url = "https://snamr.shaanxi.gov.cn/sy/ztzl/cjscgpjz/jyzjz/ajgs/jyzjzjyajgs/"
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Connection': 'keep-alive',
+            'Accept-Encoding': ACCEPT_ENCODING
         })
+        # 连接池复用 TCP/TLS 连接，并对服务端 5xx 错误自动重试
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[500, 502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # 详情页与附件使用的 aiohttp 会话，在 run() 中创建
+        self.http = None
+        self.semaphore = None
         
         # 创建数据库连接
-        self.engine = create_engine(f"sqlite:///data/cases.db")
+        self.engine = enable_sqlite_savepoints(enable_sqlite_pragmas(create_engine(f"sqlite:///data/cases.db")))
         Base.metadata.create_all(self.engine)
+        # 只有 case_name 上建立了唯一索引时才能使用 ON CONFLICT 批量写入
+        self.case_name_unique = ensure_indexes(self.engine)
         self.db_session = sessionmaker(bind=self.engine)()
         
         # 创建必要的目录
         self.attachment_dir = 'data/attachments'
         os.makedirs(self.attachment_dir, exist_ok=True)
 
-    def parse_list_page(self, page_no):
-        """解析列表页 - 改进标题和日期的分离"""
+    def parse_list_page(self, page_no, url=None):
+        """解析列表页 - 改进标题和日期的分离；url 为上一页解析出的下一页地址"""
         try:
-            # 构建URL
-            if page_no == 1:
-                url = f"{self.base_url}index.html"
-            else:
-                url = f"{self.base_url}index_{page_no-1}.html"
+            # 构建URL（未从上一页拿到链接时按 index_n.html 规则推算）
+            url = url or (f"{self.base_url}index.html" if page_no == 1 else f"{self.base_url}index_{page_no-1}.html")
             
             logger.info(f"正在访问列表页: {url}")
             response = self.session.get(url)
             response.raise_for_status() # 检查请求是否成功
-            # 尝试自动检测编码，如果失败则使用utf-8
-            response.encoding = response.apparent_encoding if response.apparent_encoding else 'utf-8'
             
-            soup = BeautifulSoup(response.text, 'html.parser')
             cases = []
-            
-            # 查找案件列表 - 选择器可能需要根据实际情况微调
-            list_items = soup.select('.news-list li') or soup.select('ul.list li')
 
-            for item in list_items:
-                link_tag = item.find('a')
-                if not link_tag:
-                    continue
-                    
-                href = link_tag.get('href')
+            list_items, next_href = self._extract_list_items(self._decode_html(response))
+            for href, full_link_text, date_str in list_items:
                 if not href:
                     continue
                 
@@ -69,12 +177,6 @@ class ShaanxiScraper:
                 case_url = urljoin(url, href) # 使用当前列表页URL作为基准
 
                 # --- 改进标题和日期提取 ---
-                date_span = item.find('span', class_='time')
-                date_str = date_span.get_text(strip=True) if date_span else None
-
-                # Get the full link text
-                full_link_text = link_tag.get_text(strip=True)
-
                 # Assume the title is the part before the date
                 title = full_link_text
                 if date_str and full_link_text.endswith(date_str):
@@ -97,29 +199,27 @@ class ShaanxiScraper:
             
             logger.info(f"第 {page_no} 页找到 {len(cases)} 个案件")
 
-            # 确定是否有下一页 (陕西的翻页逻辑比较简单，通常是递增index_n.html)
-            # 简单的假设：只要当前页能成功访问且找到内容，就认为可能有下一页
-            # 实际应用中可能需要更精确的下一页链接查找逻辑
+            # 确定是否有下一页：优先使用分页区域中的“下一页”链接
+            # 页面未渲染该链接时（如分页由脚本生成），回退到递增 index_n.html，由 404 判断末页
             next_page_no = page_no + 1
-            # 这里可以添加一个请求尝试来验证下一页是否存在，如果404则认为没有下一页
-            # next_page_url = f"{self.base_url}index_{next_page_no-1}.html"
-            # try:
-            #     next_page_response = self.session.head(next_page_url, timeout=5)
-            #     if next_page_response.status_code == 404:
-            #         next_page_no = None # 没有下一页了
-            # except requests.exceptions.RequestException:
-            #     next_page_no = None # 请求失败也认为没有下一页
+            next_page_url = urljoin(url, next_href) if next_href else None
+            if next_page_url == url:
+                # 末页的“下一页”通常指向自身
+                logger.info(f"第 {page_no} 页的下一页链接指向自身，已到达末页")
+                next_page_no, next_page_url = None, None
 
             return {
                 'cases': cases,
                 'current_page': page_no,
-                'next_page_no': next_page_no # 返回下一页的页码
+                'url': url, # 本页实际访问的地址
+                'next_page_no': next_page_no, # 返回下一页的页码
+                'next_page_url': next_page_url # 下一页地址，None 表示按页码推算
             }
             
         except requests.exceptions.HTTPError as e:
              if e.response.status_code == 404:
                  logger.warning(f"页面未找到 (404): {url}")
-                 return {'cases': [], 'current_page': page_no, 'next_page_no': None} # 404表示没有这一页了
+                 return {'cases': [], 'current_page': page_no, 'next_page_no': None, 'next_page_url': None} # 404表示没有这一页了
              else:
                  logger.error(f"访问列表页时发生HTTP错误: {url}, {str(e)}")
                  return None # 其他HTTP错误，返回None表示失败
@@ -128,15 +228,76 @@ class ShaanxiScraper:
             logger.error(traceback.format_exc())
             return None # 解析失败返回None
 
-    def parse_detail_page(self, url):
+    @staticmethod
+    def _decode_html(response):
+        """逐页解码列表页：优先响应头声明的 charset，其次页面 <meta charset>，都没有时才对整页做探测"""
+        match = _HEADER_CHARSET_RE.search(response.headers.get('Content-Type', ''))
+        known = [match.group(1)] if match else []
+        dammit = UnicodeDammit(response.content, known_definite_encodings=known, is_html=True)
+        if dammit.unicode_markup is None:
+            return response.content.decode('utf-8', errors='replace')
+        return dammit.unicode_markup
+
+    @staticmethod
+    def _extract_list_items(html):
+        """从列表页提取 (链接, 链接文本, 日期) 三元组列表，以及“下一页”链接"""
+        items = []
+        if LexborHTMLParser is not None:
+            tree = LexborHTMLParser(html)
+            list_items = tree.css('.news-list li') or tree.css('ul.list li')
+            for item in list_items:
+                link_tag = item.css_first('a')
+                if link_tag is None:
+                    continue
+                date_span = item.css_first('span.time')
+                items.append((
+                    link_tag.attributes.get('href'),
+                    link_tag.text(strip=True),
+                    date_span.text(strip=True) if date_span is not None else None,
+                ))
+            next_tag = tree.css_first(_NEXT_PAGE_SELECTOR)
+            if next_tag is None:
+                next_tag = next((a for a in tree.css('a') if a.text(strip=True) == '下一页'), None)
+            return items, _usable_href(next_tag.attributes.get('href') if next_tag is not None else None)
+
+        soup = BeautifulSoup(html, HTML_PARSER)
+        list_items = soup.select('.news-list li') or soup.select('ul.list li')
+        for item in list_items:
+            link_tag = item.find('a')
+            if not link_tag:
+                continue
+            # 链接文本只取一次；日期通常就在其末尾，匹配不到时再查找 span.time
+            link_text = link_tag.get_text(strip=True)
+            date_match = _LIST_DATE_RE.search(link_text)
+            if date_match:
+                date_str = date_match.group(1)
+            else:
+                date_span = item.find('span', class_='time')
+                date_str = date_span.get_text(strip=True) if date_span else None
+            items.append((link_tag.get('href'), link_text, date_str))
+        next_tag = soup.select_one(_NEXT_PAGE_SELECTOR) or soup.find('a', string=lambda s: s and s.strip() == '下一页')
+        return items, _usable_href(next_tag.get('href') if next_tag else None)
+
+    async def fetch_html(self, url, max_retries=3):
+        """使用 aiohttp 获取页面原始字节及响应头声明的编码，遇到 429/5xx 时指数退避重试"""
+        for attempt in range(max_retries + 1):
+            async with self.semaphore:
+                async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                    if response.status not in RETRY_STATUSES or attempt == max_retries:
+                        response.raise_for_status()
+                        return await response.read(), response.charset
+            delay = 0.5 * 2 ** attempt
+            logger.warning(f"请求 {url} 返回 {response.status}，{delay:.1f} 秒后重试 ({attempt + 1}/{max_retries})")
+            await asyncio.sleep(delay)
+
+    async def parse_detail_page(self, url):
         """解析详情页，优先从 meta 标签提取日期和附件信息"""
         try:
             logger.info(f"访问详情页: {url}")
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding if response.apparent_encoding else 'utf-8'
+            # 直接把字节交给解析器解码，避免对整页做编码探测
+            content, charset = await self.fetch_html(url)
 
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(content, HTML_PARSER, from_encoding=charset)
 
             # 获取标题
             title_tag = soup.select_one('.public-title-nav .title') or soup.select_one('h1') or soup.select_one('.article-title')
@@ -160,8 +321,7 @@ class ShaanxiScraper:
                 logger.debug(f"找到 Meta Description: {meta_content}")
                 # 使用与之前类似的正则，但应用于 meta_content
                 # Example: "公 示 期：2025年4月8日至2025年4月17日联系邮箱：jyzjz@samr.gov.cn"
-                date_pattern_meta = r'公\s*示\s*期\s*[:：]?\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})\s*日?\s*[至到-]\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})日?'
-                match_meta = re.search(date_pattern_meta, meta_content)
+                match_meta = _DATE_RE.search(meta_content)
                 if match_meta:
                     try:
                         sy, sm, sd, ey, em, ed = map(int, match_meta.groups())
@@ -185,8 +345,7 @@ class ShaanxiScraper:
                 if not dates_found_in_meta:
                     logger.debug("未在 Meta 中找到日期，回退到搜索正文内容。")
                     text_content = content_area.get_text(" ", strip=True)
-                    date_pattern_content = r'公\s*示\s*期\s*[:：]?\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})\s*日?\s*[至到-]\s*(\d{4})\s*[年-](\d{1,2})\s*[月-](\d{1,2})日?'
-                    match_content = re.search(date_pattern_content, text_content)
+                    match_content = _DATE_RE.search(text_content)
                     if match_content:
                         try:
                             sy, sm, sd, ey, em, ed = map(int, match_content.groups())
@@ -199,27 +358,24 @@ class ShaanxiScraper:
                         logger.warning(f"未在正文内容中找到公示期信息: {url}")
                 # --- 结束日期回退逻辑 ---
 
-                # --- 提取附件链接 (逻辑不变) ---
-                attachment_heading = content_area.find(lambda tag: tag.name in ['h2', 'h3', 'strong', 'p'] and '附件下载' in tag.get_text())
-                search_area = attachment_heading.find_next_sibling('ul') or attachment_heading.find_next('ul') if attachment_heading else content_area
-                if search_area:
-                     for link in search_area.find_all('a', href=True):
-                         href = link.get('href')
-                         link_text = link.get_text(strip=True)
-                         if any(ext in href.lower() for ext in ['.doc', '.docx', '.pdf', '.xls', '.xlsx', '.zip', '.rar', '.txt']):
-                              if any(keyword in link_text for keyword in ['公示表', '附件', '下载']):
-                                   attachment_url = urljoin(url, href)
-                                   attachment_name = link_text
-                                   logger.info(f"找到附件链接: {attachment_url} (名称: {attachment_name})")
-                                   break
-                     if not attachment_url:
-                           for link in search_area.find_all('a', href=True):
-                                href = link.get('href')
-                                if any(ext in href.lower() for ext in ['.doc', '.docx', '.pdf', '.xls', '.xlsx', '.zip', '.rar', '.txt']):
-                                     attachment_url = urljoin(url, href)
-                                     attachment_name = link.get_text(strip=True)
-                                     logger.warning(f"找到附件链接（无关键词）: {attachment_url} (名称: {attachment_name})")
-                                     break
+                # --- 提取附件链接：一次 CSS 查询，单遍筛选，优先带关键词的链接 ---
+                fallback_link = None
+                for link in content_area.select('a[href]'):
+                    href = link['href']
+                    if not _ATTACH_HREF_RE.search(href):
+                        continue
+                    link_text = link.get_text(strip=True)
+                    if _ATTACH_KEYWORD_RE.search(link_text):
+                        attachment_url = urljoin(url, href)
+                        attachment_name = link_text
+                        logger.info(f"找到附件链接: {attachment_url} (名称: {attachment_name})")
+                        break
+                    if fallback_link is None:
+                        fallback_link = (href, link_text)
+                if not attachment_url and fallback_link:
+                    attachment_url = urljoin(url, fallback_link[0])
+                    attachment_name = fallback_link[1]
+                    logger.warning(f"找到附件链接（无关键词）: {attachment_url} (名称: {attachment_name})")
                 # --- 结束附件提取 ---
             else:
                  logger.warning(f"未能找到详情页内容区域: {url}")
@@ -239,27 +395,19 @@ class ShaanxiScraper:
             logger.error(traceback.format_exc())
             return None
 
-    def download_attachment(self, case_name, attachment_url):
+    async def download_attachment(self, case_name, attachment_url):
         """下载附件 (复用重庆版本，更健壮)"""
         if not attachment_url:
             return None
         
         try:
-            # 从URL获取文件名，并进行解码
-            parsed_url = urlparse(attachment_url)
-            # 优先使用路径最后一部分解码后的结果
-            file_name = os.path.basename(unquote(parsed_url.path)) if parsed_url.path else None
-
-            # 如果无法从URL有效获取文件名，或文件名看起来不正常（如太短、无后缀）
-            # 则尝试基于 case_name 和 URL 后缀构建
-            if not file_name or '.' not in file_name or len(file_name) < 5:
-                 ext_match = re.search(r'\.([a-zA-Z0-9]+)$', attachment_url.lower())
-                 ext = ext_match.group(1) if ext_match else 'bin' # 默认后缀
-                 # 清理case_name作为文件名
-                 safe_case_name = re.sub(r'[\\/*?:"<>|]', "_", case_name) # 移除或替换非法字符
-                 safe_case_name = safe_case_name[:100] # 限制长度
-                 file_name = f"{safe_case_name}.{ext}"
-                 logger.warning(f"无法从URL解析有效文件名，使用生成的文件名: {file_name}")
+            # 已成功下载过的 URL 直接复用记录，无需再计算文件名或发起请求
+            downloaded = self.db_session.get(DownloadedAttachment, attachment_url)
+            if downloaded and os.path.exists(downloaded.file_path):
+                 logger.info(f"附件已下载过，跳过: {attachment_url} ({downloaded.file_path})")
+                 return downloaded.file_path
+
+            file_name = _safe_name(attachment_url, case_name)
 
             # 完整的本地保存路径
             file_path = os.path.join(self.attachment_dir, file_name)
@@ -270,16 +418,16 @@ class ShaanxiScraper:
                  return file_path # 返回已存在的文件路径
 
             logger.info(f"开始下载附件: {attachment_url} 到 {file_path}")
-            response = self.session.get(attachment_url, stream=True, timeout=120) # 增加超时时间
-            response.raise_for_status()
-            
-            # 使用 stream=True 方式写入文件
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    # filter out keep-alive new chunks
-                    if chunk:
-                        f.write(chunk)
+            async with self.semaphore:
+                async with self.http.get(attachment_url, timeout=aiohttp.ClientTimeout(total=120)) as response: # 增加超时时间
+                    response.raise_for_status()
+
+                    # 以 1 MiB 分块流式写入文件，减少 Python 层循环次数；缓冲区与分块同大，大块直接写入磁盘
+                    with open(file_path, 'wb', buffering=ATTACHMENT_CHUNK_SIZE) as f:
+                        async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                            f.write(chunk)
             
+            self.db_session.merge(DownloadedAttachment(url=attachment_url, file_path=file_path))
             logger.info(f"成功下载附件: {file_path}")
             return file_path
         except Exception as e:
@@ -287,145 +435,105 @@ class ShaanxiScraper:
             logger.error(traceback.format_exc())
             return None
 
-    def process_case(self, case):
-        """处理单个案件，修正缩进错误"""
+    def _load_existing_by_url(self, urls):
+        """一次查询取出本页涉及的已有案件，返回 {来源网址: (记录ID, 案件名称, 附件路径)}"""
+        existing = {}
+        if not urls:
+            return existing
+        for case_id, source_url, case_name, attachment_path in self.db_session.query(Case.id, Case.source_url, Case.case_name, Case.attachment_path).filter(Case.source_url.in_(urls)):
+            existing.setdefault(source_url, (case_id, case_name, attachment_path))
+        return existing
+
+    def _upsert_cases(self, rows):
+        """按案件名称批量写入：已存在则更新，不存在则插入；已有附件路径不会被覆盖"""
+        if self.case_name_unique:
+            stmt = sqlite_insert(Case).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['case_name'],
+                set_={
+                    'source_url': stmt.excluded.source_url,
+                    'region': stmt.excluded.region,
+                    'notice_start_date': stmt.excluded.notice_start_date,
+                    'notice_end_date': stmt.excluded.notice_end_date,
+                    'attachment_path': func.coalesce(Case.attachment_path, stmt.excluded.attachment_path),
+                    'created_at': stmt.excluded.created_at,
+                }
+            )
+            self.db_session.execute(stmt)
+            return
+
+        # 库中存在重名案件、无法建立唯一索引时，逐条先更新后插入
+        for row in rows:
+            values = dict(row, attachment_path=func.coalesce(Case.attachment_path, row['attachment_path']))
+            result = self.db_session.execute(update(Case).where(Case.case_name == row['case_name']).values(**values))
+            if result.rowcount == 0:
+                self.db_session.execute(insert(Case).values(**row))
+
+    async def process_case(self, case, detail_data, existing):
+        """处理单个案件，返回 (待写入的记录, 是否新案件)；existing 为本页预取的 {来源网址: (记录ID, 案件名称, 附件路径)}"""
         try:
             list_page_cleaned_title = case.get('title')
             case_url = case.get('url')
             if not list_page_cleaned_title or not case_url:
                  logger.warning(f"列表页案件信息不完整，跳过: {case}")
-                 return False
+                 return None
             query_title = list_page_cleaned_title
 
-            # --- Debugging Lookup (代码不变) ---
-            logger.info(f"Attempting DB lookup for title: '{query_title}' (Type: {type(query_title)})")
-            raw_count = -1
-            try:
-                 conn = self.db_session.connection()
-                 sql = text("SELECT COUNT(*) FROM cases WHERE case_name = :title")
-                 result = conn.execute(sql, {"title": query_title})
-                 raw_count = result.scalar()
-                 logger.info(f"Raw SQL check for title '{query_title}': Found {raw_count} matching records.")
-            except Exception as raw_e: logger.error(f"Raw SQL check failed for title '{query_title}': {raw_e}")
-            # --- End Debugging Lookup ---
-
-            existing_case = self.db_session.query(Case).filter(Case.case_name == query_title).first()
-            # --- (日志记录 ORM 结果 - 代码不变) ---
-            if existing_case: logger.info(f"ORM lookup SUCCESS for title '{query_title}'. Found existing case.")
-            else:
-                 if raw_count > 0: logger.error(f"ORM lookup FAILED for title '{query_title}' BUT Raw SQL found {raw_count} matches. Potential ORM/Session issue?")
-                 elif raw_count == 0: logger.info(f"ORM lookup FAILED for title '{query_title}'. Raw SQL also found 0 matches. Treating as new case.")
-                 else: logger.warning(f"ORM lookup FAILED for title '{query_title}'. Raw SQL check also failed.")
-
-            detail_data = self.parse_detail_page(case_url);
-            if not detail_data: return False
+            # 详情页已在 run() 中并发抓取，失败时直接跳过，不再重复请求
+            if not detail_data: return None
             detail_page_cleaned_title = detail_data.get('title')
 
-            if not existing_case and detail_page_cleaned_title and detail_page_cleaned_title != query_title:
-                logger.debug(f"Initial lookup failed for '{query_title}', retrying with detail title '{detail_page_cleaned_title}'...")
-                existing_case = self.db_session.query(Case).filter(Case.case_name == detail_page_cleaned_title).first()
-                if existing_case: logger.info(f"Found existing case using detail page title: '{detail_page_cleaned_title}'")
-
             final_title = detail_page_cleaned_title or query_title
-            if not final_title: return False
-
-            if existing_case:
-                # --- Update existing case ---
-                logger.info(f"案件已存在: '{existing_case.case_name}'. Updating with latest data...")
-                updated_fields = []
-                if existing_case.case_name != final_title: existing_case.case_name = final_title; updated_fields.append("名称")
-                if existing_case.region != '陕西': existing_case.region = '陕西'; updated_fields.append("地区")
-                if existing_case.notice_start_date != detail_data['start_date']: existing_case.notice_start_date = detail_data['start_date']; updated_fields.append("开始日期")
-                if existing_case.notice_end_date != detail_data['end_date']: existing_case.notice_end_date = detail_data['end_date']; updated_fields.append("结束日期")
-
-                # Update attachment (only download if missing)
-                if not existing_case.attachment_path and detail_data['attachment_url']: # Level 1 indent
-                    dl_path = self.download_attachment(final_title, detail_data['attachment_url']) # Level 2 indent
-                    if dl_path: # Level 2 indent (Corrected)
-                        existing_case.attachment_path = dl_path
-                        updated_fields.append("附件路径")
-                elif existing_case.attachment_path: # Level 1 indent
-                     logger.debug(f"案件已有附件记录: {existing_case.attachment_path}") # Level 2 indent
-
-                if existing_case.source_url != case_url: existing_case.source_url = case_url; updated_fields.append("来源网址")
-                existing_case.created_at = datetime.now(); updated_fields.append("爬取时间")
-
-                # Commit changes
-                db_update_successful = False
-                try:
-                    self.db_session.flush()
-                    self.db_session.commit()
-                    db_update_successful = True # Mark as successful if commit doesn't raise error
-                    if updated_fields:
-                        logger.info(f"成功更新数据库 '{final_title}': {'; '.join(updated_fields)}")
-                    else:
-                        logger.info(f"数据库案件无需更新字段 (仅更新时间戳): {final_title}")
-
-                    # --- Post-Commit Verification Read ---
-                    if db_update_successful and "开始日期" in updated_fields: # Check only if we tried to update the date
-                        logger.info(f"Verifying date persistence for '{final_title}'...")
-                        verify_conn = None
-                        try:
-                            # Create a completely new connection and cursor
-                            verify_conn = sqlite3.connect('data/cases.db') # Use the known path directly
-                            verify_cursor = verify_conn.cursor()
-                            # Query using the exact name we just committed
-                            verify_cursor.execute("SELECT notice_start_date, notice_end_date FROM cases WHERE case_name = ?", (final_title,))
-                            verify_result = verify_cursor.fetchone()
-                            if verify_result:
-                                 persisted_start, persisted_end = verify_result
-                                 logger.info(f"  Post-commit read: notice_start_date='{persisted_start}' (Type: {type(persisted_start)}), notice_end_date='{persisted_end}' (Type: {type(persisted_end)})")
-                                 # Compare with what we tried to save
-                                 expected_start_str = detail_data['start_date'].strftime('%Y-%m-%d %H:%M:%S') if detail_data['start_date'] else None
-                                 if str(persisted_start) != str(expected_start_str): # Compare string representation for simplicity
-                                      logger.error(f"  *** Verification FAILED! Expected start '{expected_start_str}', but DB read '{persisted_start}'.")
-                            else:
-                                logger.error(f"  *** Verification FAILED! Could not re-read case '{final_title}' immediately after commit.")
-                        except Exception as verify_e:
-                            logger.error(f"  *** Verification Read Error: {verify_e}")
-                        finally:
-                            if verify_conn: verify_conn.close()
-                    # --- End Post-Commit Verification Read ---
-
-                except Exception as e:
-                    logger.error(f"DB更新失败 '{final_title}': {e}"); self.db_session.rollback()
-
-                return False # Not a new case
-            else:
-                # --- Add new case ---
-                # ...(检查 final_title 是否存在 - 代码不变)...
-                if final_title != query_title:
-                     existing_case_final = self.db_session.query(Case).filter(Case.case_name == final_title).first()
-                     if existing_case_final: logger.warning(f"Attempted to add '{final_title}' as new, but it already exists. Skipping add."); return False
+            if not final_title: return None
 
-                # ...(添加新记录逻辑 - 代码不变)...
+            # 来源网址在每条公示中唯一，按网址判断是否已存在，不受标题差异影响
+            stored_id, stored_name, attachment_path = existing.get(case_url, (None, None, None))
+            is_new = stored_name is None
+            if is_new:
                 logger.info(f"添加新案件: '{final_title}'")
-                attachment_path = None
-                if detail_data['attachment_url']: attachment_path = self.download_attachment(final_title, detail_data['attachment_url'])
-                new_case = Case(
-                    case_name=final_title,
-                    source_url=case_url,
-                    region='陕西',
-                    notice_start_date=detail_data['start_date'],
-                    notice_end_date=detail_data['end_date'],
-                    attachment_path=attachment_path,
-                    created_at=datetime.now()
-                )
-                try:
-                    self.db_session.add(new_case)
-                    self.db_session.commit()
-                    logger.info(f"成功添加新案件到数据库: {final_title}")
-                    return True
-                except Exception as e:
-                    logger.error(f"DB添加失败 '{final_title}': {e}")
-                    self.db_session.rollback()
-                    return False
-        except Exception as e: logger.error(f"处理案件 '{case.get('title', 'N/A')}' 失败: {e}"); logger.error(traceback.format_exc()); return False
-
-    def run(self, max_page=None): # 添加 max_page 参数
-        """运行爬虫，增加最高页码限制"""
+            elif stored_name != final_title:
+                # 标题有变化：先把原记录改名，后续按新名称 UPSERT
+                # 新名称已被其他记录占用时不改名（case_name 唯一索引会报错），直接按新名称合并到那条记录
+                taken = self.db_session.query(Case.id).filter(Case.case_name == final_title, Case.id != stored_id).first()
+                if taken:
+                    logger.warning(f"案件已存在: '{stored_name}'. 新名称 '{final_title}' 已被其他记录使用，合并到该记录...")
+                else:
+                    logger.info(f"案件已存在: '{stored_name}'. 更名为 '{final_title}' 并更新...")
+                    self.db_session.execute(update(Case).where(Case.id == stored_id).values(case_name=final_title))
+            else:
+                logger.info(f"案件已存在: '{final_title}'. Updating with latest data...")
+
+            # 仅在没有附件记录时下载
+            if attachment_path:
+                logger.debug(f"案件已有附件记录: {attachment_path}")
+            elif detail_data['attachment_url']:
+                attachment_path = await self.download_attachment(final_title, detail_data['attachment_url'])
+
+            existing[case_url] = (stored_id, final_title, attachment_path)
+            row = {
+                'case_name': final_title,
+                'source_url': case_url,
+                'region': '陕西',
+                'notice_start_date': detail_data['start_date'],
+                'notice_end_date': detail_data['end_date'],
+                'attachment_path': attachment_path,
+                'created_at': datetime.now(),
+            }
+            return row, is_new
+        # 异常继续抛出，由 run() 中的 SAVEPOINT 回滚该案件
+        except Exception as e: logger.error(f"处理案件 '{case.get('title', 'N/A')}' 失败: {e}"); logger.error(traceback.format_exc()); raise
+
+    async def run(self, max_page=None): # 添加 max_page 参数
+        """运行爬虫，增加最高页码限制；每页的详情页并发抓取"""
+        self.semaphore = asyncio.Semaphore(DETAIL_CONCURRENCY)
+        self.http = aiohttp.ClientSession(
+            headers={'User-Agent': self.session.headers['User-Agent']},
+            connector=aiohttp.TCPConnector(limit_per_host=DETAIL_CONCURRENCY, ssl=False)
+        )
         try:
             current_page_no = 1
+            current_page_url = None
+            visited_urls = set() # 已访问过的列表页地址，防止“下一页”链接回指导致死循环
             total_new_cases = 0
             processed_pages = 0
             
@@ -437,7 +545,7 @@ class ShaanxiScraper:
 
                 logger.info(f"--- 开始处理第 {current_page_no} 页 ---")
                 # 解析列表页
-                page_data = self.parse_list_page(current_page_no)
+                page_data = self.parse_list_page(current_page_no, current_page_url)
                 
                 # 处理解析失败或404的情况
                 if page_data is None:
@@ -448,20 +556,40 @@ class ShaanxiScraper:
                      break # 如果当前页是404且无案件，则停止
 
                 processed_pages += 1
+                visited_urls.add(page_data['url'])
                 cases = page_data['cases']
                 
                 if cases:
                     logger.info(f"第 {current_page_no} 页找到 {len(cases)} 个案件")
+                    # 并发抓取本页所有详情页，数据库写入仍按顺序进行
+                    details = await asyncio.gather(*(self.parse_detail_page(case['url']) for case in cases if case.get('url')))
+                    details_by_url = dict(zip((case['url'] for case in cases if case.get('url')), details))
+                    # 一次查询按来源网址取出本页已有的案件
+                    existing = self._load_existing_by_url(list(details_by_url))
+
+                    # 每个案件使用 SAVEPOINT，单个案件失败只回滚自身；整页一次 UPSERT、一次提交
+                    rows = {}
+                    page_new_cases = 0
                     for case in cases:
                         try:
-                            # 使用 await 如果 process_case 是异步的，但这里不是
-                            is_new = self.process_case(case)
-                            if is_new:
-                                total_new_cases += 1
-                            # 可以加短暂延迟避免请求过快
-                            # time.sleep(0.5)
+                            with self.db_session.begin_nested():
+                                result = await self.process_case(case, details_by_url.get(case.get('url')), existing)
+                            if result:
+                                row, is_new = result
+                                rows[row['case_name']] = row
+                                if is_new:
+                                    page_new_cases += 1
                         except Exception as e:
-                            logger.error(f"处理案件失败: {case.get('title', 'N/A')}, 错误: {str(e)}")
+                            logger.error(f"处理案件失败（已回滚该案件）: {case.get('title', 'N/A')}, 错误: {str(e)}")
+                    try:
+                        if rows:
+                            self._upsert_cases(list(rows.values()))
+                        self.db_session.commit()
+                        logger.info(f"第 {current_page_no} 页写入 {len(rows)} 个案件，其中新增 {page_new_cases} 个")
+                        total_new_cases += page_new_cases
+                    except Exception as e:
+                        logger.error(f"第 {current_page_no} 页提交数据库失败: {str(e)}")
+                        self.db_session.rollback()
                 else:
                     logger.warning(f"第 {current_page_no} 页未找到案件")
                     # 即使当前页没案件，也尝试下一页，除非 next_page_no 是 None
@@ -469,6 +597,10 @@ class ShaanxiScraper:
                 # 获取下一页页码
                 next_page_no = page_data.get('next_page_no')
                 if next_page_no:
+                    current_page_url = page_data.get('next_page_url')
+                    if current_page_url in visited_urls:
+                        logger.info(f"下一页链接指向已访问过的列表页: {current_page_url}，停止爬取。")
+                        break
                     current_page_no = next_page_no
                     logger.info(f"准备处理第 {current_page_no} 页")
                     # time.sleep(1) # 页面间延迟
@@ -487,79 +619,40 @@ class ShaanxiScraper:
             logger.error(f"爬虫运行出错: {str(e)}")
             logger.error(traceback.format_exc())
         finally:
+            await self.http.close()
             logger.info("关闭数据库会话。")
             self.db_session.close()
 
     def export_data(self):
         """导出数据到Excel，合并、更新并保留原有记录，减少日志"""
         excel_path = os.path.join('data', 'cases.xlsx')
+        hash_path = os.path.join('data', 'cases.hash')
         shaanxi_domain = "shaanxi.gov.cn" # Example domain
         logger.info(f"准备导出数据到Excel: {excel_path}")
 
         try:
-            # 1. 从数据库加载数据
-            orm_failed_due_to_date = False
-            db_records = []
-            try:
-                logger.info("尝试使用 ORM 读取数据库...")
-                query = self.db_session.query(Case).with_entities(
-                    Case.case_name, Case.notice_start_date, Case.notice_end_date,
-                    Case.source_url, Case.attachment_path, Case.region, Case.created_at
-                )
-                orm_results = query.all(); logger.info(f"ORM 查询成功获取 {len(orm_results)} 行。")
-                for row_tuple in orm_results:
-                    (case_name, start_date_val, end_date_val, source_url, att_path, region, created_at_val) = row_tuple
-                    start_date, end_date, created_at = None, None, None
-                    try: # Dates conversion (copy-paste)
-                        if isinstance(start_date_val, datetime): start_date = start_date_val
-                        elif isinstance(start_date_val, str): start_date = datetime.strptime(start_date_val, '%Y-%m-%d')
-                    except: start_date = None
-                    try:
-                        if isinstance(end_date_val, datetime): end_date = end_date_val
-                        elif isinstance(end_date_val, str): end_date = datetime.strptime(end_date_val, '%Y-%m-%d')
-                    except: end_date = None
-                    try:
-                        if isinstance(created_at_val, datetime): created_at = created_at_val
-                        elif isinstance(created_at_val, str):
-                             try: created_at = datetime.strptime(created_at_val, '%Y-%m-%d %H:%M:%S')
-                             except ValueError: created_at = datetime.strptime(created_at_val, '%Y-%m-%d')
-                    except: created_at = None
-                    db_records.append({ '案件名称': case_name, '公示开始日期': start_date, '公示结束日期': end_date, '来源网址': source_url, '附件路径': att_path, '地区': region, '爬取时间': created_at })
-            except ValueError as e:
-                if "day is out of range" in str(e): orm_failed_due_to_date = True; logger.error(f"ORM日期错误: {e} -> RawSQL")
-                else: raise e
-            except Exception as db_read_e: raise db_read_e
-            if orm_failed_due_to_date: # Raw SQL Fallback
-                db_records = []; logger.info("尝试使用原始 SQL 读取数据库...")
-                try:
-                    conn = self.engine.connect(); raw_query = text("SELECT case_name, notice_start_date, notice_end_date, source_url, attachment_path, region, created_at FROM cases"); result = conn.execute(raw_query); raw_rows = result.fetchall(); conn.close(); logger.info(f"原始 SQL 查询成功获取 {len(raw_rows)} 行。")
-                    for row_tuple in raw_rows:
-                        (case_name, start_date_val, end_date_val, source_url, att_path, region, created_at_val) = row_tuple
-                        start_date, end_date, created_at = None, None, None
-                        try: # Dates conversion (copy-paste)
-                            if isinstance(start_date_val, str): start_date = datetime.strptime(start_date_val, '%Y-%m-%d')
-                            elif isinstance(start_date_val, datetime): start_date = start_date_val
-                        except: start_date = None
-                        try:
-                            if isinstance(end_date_val, str): end_date = datetime.strptime(end_date_val, '%Y-%m-%d')
-                            elif isinstance(end_date_val, datetime): end_date = end_date_val
-                        except: end_date = None
-                        try:
-                            if isinstance(created_at_val, str):
-                                 try: created_at = datetime.strptime(created_at_val, '%Y-%m-%d %H:%M:%S')
-                                 except ValueError: created_at = datetime.strptime(created_at_val, '%Y-%m-%d')
-                            elif isinstance(created_at_val, datetime): created_at = created_at_val
-                        except: created_at = None
-                        db_records.append({ '案件名称': case_name, '公示开始日期': start_date, '公示结束日期': end_date, '来源网址': source_url, '附件路径': att_path, '地区': region, '爬取时间': created_at })
-                except Exception as raw_sql_e: logger.error(f"RawSQL错误: {raw_sql_e}"); return None
-            if not db_records: logger.error("数据库无记录"); return None
-            current_df = pd.DataFrame(db_records)
-            # Clean DB names and convert dates BEFORE setting index
+            # 1. 从数据库加载数据：一次查询直接得到 DataFrame，日期列在 pandas 中向量化解析，无效日期置为 NaT
+            # 库中日期格式混杂（'%Y-%m-%d'、带时间、带微秒），必须逐值识别格式，不能按首行推断
+            current_df = pd.read_sql_query(
+                _EXPORT_SQL,
+                self.engine,
+                parse_dates={col: {'errors': 'coerce', 'format': 'mixed'} for col in ('公示开始日期', '公示结束日期', '爬取时间')}
+            )
+            if current_df.empty: logger.error("数据库无记录"); return None
+            # Clean DB names BEFORE setting index
             current_df['案件名称'] = current_df['案件名称'].astype(str).str.strip()
-            current_df['公示开始日期'] = pd.to_datetime(current_df['公示开始日期'], errors='coerce')
-            current_df['公示结束日期'] = pd.to_datetime(current_df['公示结束日期'], errors='coerce')
-            current_df['爬取时间'] = pd.to_datetime(current_df['爬取时间'], errors='coerce')
-            logger.info(f"从数据库加载 {len(current_df)} 条记录 (使用 {'Raw SQL' if orm_failed_due_to_date else 'ORM'}).")
+            logger.info(f"从数据库加载 {len(current_df)} 条记录。")
+
+            # 数据库内容与上次导出时一致、且Excel未被其他程序改写时，跳过读取、合并与写入
+            # 爬取时间每次运行都会刷新，不参与比较
+            db_hash = hashlib.sha256(
+                pd.util.hash_pandas_object(current_df.drop(columns=['爬取时间']), index=False).values.tobytes()
+            ).hexdigest()
+            cached = _load_export_state(hash_path)
+            if (cached and cached.get('hash') == db_hash and os.path.exists(excel_path)
+                    and os.path.getmtime(excel_path) == cached.get('mtime')):
+                logger.info("数据库内容自上次导出后未变化，跳过Excel更新。")
+                return { 'excel_path': excel_path, 'total_cases': cached['total'] }
 
             # 2. 读取现有的Excel文件
             existing_df = pd.DataFrame() # Initialize empty
@@ -570,9 +663,8 @@ class ShaanxiScraper:
                      # Clean Excel names and convert dates
                      if '案件名称' not in existing_df.columns: logger.error("Excel缺少'案件名称'列"); return None
                      existing_df['案件名称'] = existing_df['案件名称'].astype(str).str.strip()
-                     existing_df['公示开始日期'] = pd.to_datetime(existing_df['公示开始日期'], errors='coerce')
-                     existing_df['公示结束日期'] = pd.to_datetime(existing_df['公示结束日期'], errors='coerce')
-                     existing_df['爬取时间'] = pd.to_datetime(existing_df['爬取时间'], errors='coerce')
+                     for col in ('公示开始日期', '公示结束日期', '爬取时间'):
+                         if col in existing_df.columns: existing_df[col] = _to_datetime_cached(existing_df[col])
                      logger.info(f"从Excel加载 {len(existing_df)} 条记录。")
                  except Exception as e:
                      logger.error(f"读取Excel文件失败: {excel_path}, 错误: {str(e)}. 将只使用数据库数据。")
@@ -580,79 +672,52 @@ class ShaanxiScraper:
 
             # 3. 合并与更新
             if not existing_df.empty:
-                current_df_indexed = current_df.set_index('案件名称')
-                update_count = 0
                 # Ensure all columns exist in existing_df for safe assignment
                 for col in ['案件名称', '公示开始日期', '公示结束日期', '地区', '来源网址', '附件路径', '爬取时间']:
                      if col not in existing_df.columns: existing_df[col] = pd.NaT if '日期' in col or '时间' in col else None
 
+                # 地区只有少数几个取值，用分类类型；网址和附件路径用 string 类型，比较更快、内存更省
+                for df in (existing_df, current_df):
+                    df['地区'] = df['地区'].astype('category')
+                    df['来源网址'] = df['来源网址'].astype('string')
+                    df['附件路径'] = df['附件路径'].astype('string')
+                if '陕西' not in existing_df['地区'].cat.categories:
+                    existing_df['地区'] = existing_df['地区'].cat.add_categories('陕西')
+
                 logger.info("开始比较并更新 Excel 数据...")
-                for idx, row in existing_df.iterrows():
-                    case_name = row['案件名称'] # Already cleaned
-                    if pd.isna(case_name) or case_name == '': continue
-
-                    if case_name in current_df_indexed.index:
-                        db_record_lookup = current_df_indexed.loc[case_name]
-                        db_record = db_record_lookup.iloc[0] if isinstance(db_record_lookup, pd.DataFrame) else db_record_lookup
-
-                        row_updated_flag = False
-                        update_reasons = [] # Keep track of reasons even if not logged per row
-
-                        db_source_url = db_record['来源网址']
-                        is_shaanxi_case = isinstance(db_source_url, str) and shaanxi_domain in db_source_url
-
-                        # Region Update Logic (unchanged)
-                        excel_region = row['地区']
-                        if is_shaanxi_case and excel_region != '陕西':
-                             existing_df.loc[idx, '地区'] = '陕西'; row_updated_flag = True
-                             update_reasons.append(f"地区从'{excel_region}'改为'陕西'")
-
-                        # --- Remove detailed date debugging logs ---
-                        db_start_date = db_record['公示开始日期']
-                        excel_start_date = row['公示开始日期']
-                        db_end_date = db_record['公示结束日期']
-                        excel_end_date = row['公示结束日期']
-
-                        # --- Existing Date Update Logic (unchanged logic, remove per-row logs) ---
-                        # Compare Start Date
-                        start_needs_update = (pd.isna(excel_start_date) != pd.isna(db_start_date)) or \
-                                             (pd.notna(excel_start_date) and pd.notna(db_start_date) and excel_start_date != db_start_date)
-                        if start_needs_update:
-                            existing_df.loc[idx, '公示开始日期'] = db_start_date
-                            update_reasons.append(f"更新开始日期从'{excel_start_date}'为'{db_start_date}'")
-                            row_updated_flag = True
-                            # logger.info(f"    -> Start Date marked for update.") # Commented out
-
-                        # Compare End Date
-                        end_needs_update = (pd.isna(excel_end_date) != pd.isna(db_end_date)) or \
-                                           (pd.notna(excel_end_date) and pd.notna(db_end_date) and excel_end_date != db_end_date)
-                        if end_needs_update:
-                            existing_df.loc[idx, '公示结束日期'] = db_end_date
-                            update_reasons.append(f"更新结束日期从'{excel_end_date}'为'{db_end_date}'")
-                            row_updated_flag = True
-                            # logger.info(f"    -> End Date marked for update.") # Commented out
-
-                        # Other field updates (unchanged logic)
-                        if row['来源网址'] != db_source_url:
-                            existing_df.loc[idx, '来源网址'] = db_source_url; row_updated_flag = True; update_reasons.append("更新来源网址")
-                        db_attachment_path = db_record['附件路径']
-                        if row['附件路径'] != db_attachment_path:
-                             existing_df.loc[idx, '附件路径'] = db_attachment_path; row_updated_flag = True; update_reasons.append("更新附件路径")
-                        db_crawl_time = db_record['爬取时间']
-                        if pd.isna(row['爬取时间']) or (pd.notna(db_crawl_time) and row['爬取时间'] < db_crawl_time): # Only update if DB is newer or Excel is null
-                             existing_df.loc[idx, '爬取时间'] = db_crawl_time
-                             if pd.notna(db_crawl_time): update_reasons.append(f"更新爬取时间为'{db_crawl_time.strftime('%Y-%m-%d %H:%M:%S')}'")
-                             else: update_reasons.append("更新爬取时间为'NaT'")
-                             row_updated_flag = True
-
-                        if row_updated_flag:
-                             # logger.info(f"Excel 更新 [{case_name}]: {'; '.join(update_reasons)}") # Commented out
-                             update_count += 1
+                # 以案件名称为索引的数据库视图（同名取第一条），按 Excel 每行的名称做哈希查找对齐，整列比较后一次性赋值
+                db_view = current_df.drop_duplicates('案件名称').set_index('案件名称')
+                # 是否来自陕西站点：在数据库视图上整列计算一次，随对齐带到每一行
+                db_view['_is_shaanxi'] = db_view['来源网址'].str.contains(shaanxi_domain, na=False, regex=False)
+                aligned = db_view.reindex(existing_df['案件名称'])
+                aligned.index = existing_df.index
+                matched = existing_df['案件名称'].isin(db_view.index)
+                row_updated = pd.Series(False, index=existing_df.index)
+
+                # Region Update Logic: 来源为陕西站点的案件地区统一为'陕西'
+                is_shaanxi = aligned['_is_shaanxi'].fillna(False).astype(bool)
+                region_update = matched & is_shaanxi & (existing_df['地区'] != '陕西')
+                existing_df.loc[region_update, '地区'] = '陕西'
+                row_updated |= region_update
+
+                # 日期、来源网址、附件路径：与数据库不一致（含一方为空）时以数据库为准
+                for col in ['公示开始日期', '公示结束日期', '来源网址', '附件路径']:
+                    col_update = matched & _changed(existing_df[col], aligned[col])
+                    existing_df.loc[col_update, col] = aligned.loc[col_update, col]
+                    row_updated |= col_update
+
+                # 爬取时间: Only update if DB is newer or Excel is null
+                db_crawl_time = aligned['爬取时间']
+                crawl_update = matched & (existing_df['爬取时间'].isna() | (db_crawl_time.notna() & (existing_df['爬取时间'] < db_crawl_time)))
+                existing_df.loc[crawl_update, '爬取时间'] = db_crawl_time[crawl_update]
+                row_updated |= crawl_update
+
+                update_count = int(row_updated.sum())
 
                 # Find new cases and merge
                 current_df['案件名称'] = current_df['案件名称'].astype(str).str.strip()
-                existing_case_names = set(existing_df['案件名称'].dropna())
-                new_cases_df = current_df[~current_df['案件名称'].isin(existing_case_names)]
+                # 直接把 Series 交给 isin，避免先构建 Python set 再重新哈希
+                new_cases_df = current_df[~current_df['案件名称'].isin(existing_df['案件名称'].dropna())]
 
                 logger.info(f"Excel: {update_count} existing records updated based on DB data.") # Log summary count
                 if not new_cases_df.empty:
@@ -671,7 +736,9 @@ class ShaanxiScraper:
             # 4. Sort and Write to Excel
             if not final_df.empty:
                  logger.info(f"Final DF for Excel: {len(final_df)} rows.")
-                 # ... (Sorting, formatting, writing - unchanged) ...
+                 final_df = final_df.sort_values(by=['公示开始日期'], ascending=False, na_position='last')
+                 write_excel(final_df, excel_path)
+                 _save_export_state(hash_path, {'hash': db_hash, 'total': len(final_df), 'mtime': os.path.getmtime(excel_path)})
                  logger.info(f"数据成功导出到Excel文件: {excel_path}"); logger.info(f"最终Excel文件包含 {len(final_df)} 条记录")
                  return { 'excel_path': excel_path, 'total_cases': len(final_df) }
             else: logger.info("最终DataFrame为空，未写入Excel。"); return None
@@ -690,7 +757,7 @@ def main(max_page=None): # 添加 max_page 参数
     
     scraper = ShaanxiScraper()
     logger.info(f"开始运行陕西爬虫，限制页码为: {'无限制' if max_page is None else max_page} 页...")
-    scraper.run(max_page=max_page) # 将 max_page 传递给 run 方法
+    asyncio.run(scraper.run(max_page=max_page)) # 将 max_page 传递给 run 方法
     logger.info("陕西爬虫运行结束。")
 
 if __name__ == "__main__":
@@ -1,17 +1,64 @@
 import asyncio
 import logging
 import os
-import requests
+import time
+import aiohttp
 from datetime import datetime
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
-from models import Case, Base
-from sqlalchemy import create_engine
+import soupsieve
+from models import Case, Base, enable_sqlite_pragmas
+from exporter import write_excel
+from sqlalchemy import create_engine, select
 from sqlalchemy.orm import sessionmaker
 import pandas as pd
 import traceback
 import re
 
+# 公示期日期范围，兼容以下写法：
+#   公示期：年月日至年月日 / 公 示 期：... / &emsp;公示期：... / 公&nbsp;示&nbsp;期：...
+_DATE_RE = re.compile(r'公(?:\s|&nbsp;)*示(?:\s|&nbsp;)*期：(\d{4})年(\d{1,2})月(\d{1,2})日至(\d{4})年(\d{1,2})月(\d{1,2})日')
+
+# 优先使用 lxml 解析器（C 实现，速度快），未安装时回退到内置的 html.parser
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
+# 预编译的 CSS 选择器，避免每次 select 时重新解析选择器
+_ROW_SEL = soupsieve.compile('tr.table_list_tr1, tr.table_list_tr2')
+_LINK_SEL = soupsieve.compile('td.overflow a')
+_CONTENT_SEL = soupsieve.compile('div#ivs_content')
+
+# 详情页并发数与请求速率（每秒请求数 / 允许的突发请求数）
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 4
+REQUEST_BURST = 8
+# 附件下载的分块大小
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+class RateLimiter:
+    """令牌桶限速器：平均每秒最多 rate 个请求，最多允许 burst 个突发请求"""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """取得一个令牌，令牌不足时等待补充"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,19 +67,22 @@ class ShanghaiScraper:
     def __init__(self):
         """初始化上海爬虫"""
         self.base_url = "https://scjgj.sh.gov.cn/1571/"
-        self.session = requests.Session()
-        self.session.verify = False
-        headers = {
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1'
         }
-        self.session.headers.update(headers)
+        # aiohttp 会话、并发控制与限速器在 __aenter__ 中创建
+        self.http = None
+        self.semaphore = None
+        self.rate_limiter = None
+        # 按保存路径加锁，避免并发处理的案件同时写同名附件
+        self._download_locks = {}
         
         # 初始化数据库会话
-        engine = create_engine('sqlite:///data/cases.db')
+        engine = enable_sqlite_pragmas(create_engine('sqlite:///data/cases.db'))
         Base.metadata.create_all(engine)
         Session = sessionmaker(bind=engine)
         self.db_session = Session()
@@ -41,25 +91,46 @@ class ShanghaiScraper:
         self.attachment_dir = 'data/attachments'
         os.makedirs(self.attachment_dir, exist_ok=True)
 
+    async def __aenter__(self):
+        """创建共享的 aiohttp 会话"""
+        self.http = aiohttp.ClientSession(
+            headers=self.headers,
+            connector=aiohttp.TCPConnector(ssl=False, limit=16)  # 与原 verify=False 行为一致
+        )
+        self.semaphore = asyncio.Semaphore(CONCURRENCY)
+        self.rate_limiter = RateLimiter(REQUESTS_PER_SECOND, REQUEST_BURST)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """关闭 aiohttp 会话"""
+        if self.http:
+            await self.http.close()
+
+    async def fetch_html(self, url, timeout=30):
+        """经限速后使用共享会话获取页面原始字节，同时返回响应头声明的编码（可能为 None）"""
+        await self.rate_limiter.acquire()
+        async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+            return await response.read(), response.charset
+
     async def parse_list_page(self, url):
         """解析列表页"""
         try:
             logger.info(f"访问列表页: {url}")
-            response = self.session.get(url, timeout=60)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
+            html, charset = await self.fetch_html(url, timeout=60)
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            # 交给 BeautifulSoup 解码：有响应头编码时优先使用，否则按 <meta charset> 等识别
+            soup = BeautifulSoup(html, HTML_PARSER, from_encoding=charset)
             
             # 获取案件链接
             cases = []
-            case_rows = soup.select('tr.table_list_tr1, tr.table_list_tr2')
+            case_rows = _ROW_SEL.select(soup)
             
             if case_rows:
                 logger.info(f"在列表页找到 {len(case_rows)} 个案件")
                 for row in case_rows:
-                    link = row.select_one('td.overflow a')
-                    date_td = row.select('td')[3]  # 第4个td是发布日期
+                    link = _LINK_SEL.select_one(row)
+                    date_td = row.find_all('td')[3]  # 第4个td是发布日期
                     
                     if link and date_td:
                         title = link.get_text(strip=True)
@@ -76,7 +147,7 @@ class ShanghaiScraper:
                             logger.info(f"找到案件: {title}")
             
             if not cases:
-                logger.error(f"未找到案件列表，页面内容长度: {len(response.text)}")
+                logger.error(f"未找到案件列表，页面内容长度: {len(html)}")
                 return None
             
             # 获取当前页码和构造下一页链接
@@ -109,14 +180,12 @@ class ShanghaiScraper:
         """解析详情页"""
         try:
             logger.info(f"访问详情页: {url}")
-            response = self.session.get(url, timeout=30)
-            response.raise_for_status()
-            response.encoding = response.apparent_encoding
+            html, charset = await self.fetch_html(url, timeout=30)
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = BeautifulSoup(html, HTML_PARSER, from_encoding=charset)
             
             # 获取内容容器
-            content_div = soup.select_one('div#ivs_content')
+            content_div = _CONTENT_SEL.select_one(soup)
             if not content_div:
                 logger.error("未找到内容容器")
                 return None
@@ -127,51 +196,16 @@ class ShanghaiScraper:
             start_date = None
             end_date = None
             
-            # 尝试多个日期格式模式
-            date_patterns = [
-                # 标准格式：年月日至年月日
-                r'公示期：(\d{4}年\d{1,2}月\d{1,2}日)至(\d{4}年\d{1,2}月\d{1,2}日)',
-                # 带空格的格式：公 示 期：年月日至年月日
-                r'公\s*示\s*期：(\d{4}年\d{1,2}月\d{1,2}日)至(\d{4}年\d{1,2}月\d{1,2}日)',
-                # 带缩进的格式：[空格]公示期：年月日至年月日
-                r'\s*公示期：(\d{4}年\d{1,2}月\d{1,2}日)至(\d{4}年\d{1,2}月\d{1,2}日)',
-                # HTML缩进格式：&emsp;公示期：年月日至年月日
-                r'&emsp;公示期：(\d{4}年\d{1,2}月\d{1,2}日)至(\d{4}年\d{1,2}月\d{1,2}日)',
-                # 带HTML空格的格式：公&nbsp;示&nbsp;期：年月日至年月日
-                r'公&nbsp;示&nbsp;期：(\d{4}年\d{1,2}月\d{1,2}日)至(\d{4}年\d{1,2}月\d{1,2}日)'
-            ]
-            
-            # 获取原始HTML内容
-            content_html = str(content_div)
-            
-            # 依次尝试各种模式
-            date_match = None
-            for pattern in date_patterns:
-                date_match = re.search(pattern, content_html)
-                if date_match:
-                    try:
-                        start_date = datetime.strptime(date_match.group(1), '%Y年%m月%d日')
-                        end_date = datetime.strptime(date_match.group(2), '%Y年%m月%d日')
-                        logger.info(f"成功提取日期范围: {start_date.date()} 至 {end_date.date()}")
-                        break
-                    except ValueError as e:
-                        logger.error(f"日期转换失败: {str(e)}")
-                        continue
-            
-            if not date_match:
-                # 如果所有模式都失败，尝试直接从文本内容中提取
-                content_text = content_div.get_text()
-                for pattern in date_patterns:
-                    date_match = re.search(pattern, content_text)
-                    if date_match:
-                        try:
-                            start_date = datetime.strptime(date_match.group(1), '%Y年%m月%d日')
-                            end_date = datetime.strptime(date_match.group(2), '%Y年%m月%d日')
-                            logger.info(f"从文本内容成功提取日期范围: {start_date.date()} 至 {end_date.date()}")
-                            break
-                        except ValueError as e:
-                            logger.error(f"日期转换失败: {str(e)}")
-                            continue
+            # 先在原始HTML中查找公示期，找不到再查纯文本（一个预编译的正则覆盖全部写法）
+            date_match = _DATE_RE.search(str(content_div)) or _DATE_RE.search(content_div.get_text())
+            if date_match:
+                try:
+                    sy, sm, sd, ey, em, ed = map(int, date_match.groups())
+                    start_date = datetime(sy, sm, sd)
+                    end_date = datetime(ey, em, ed)
+                    logger.info(f"成功提取日期范围: {start_date.date()} 至 {end_date.date()}")
+                except ValueError as e:
+                    logger.error(f"日期转换失败: {str(e)}")
 
             if not start_date or not end_date:
                 logger.warning(f"未找到日期信息或日期格式不正确: {url}")
@@ -204,50 +238,55 @@ class ShanghaiScraper:
             return None
 
     async def download_attachment(self, url, save_path):
-        """下载附件，按文件名查重"""
-        try:
-            # 检查文件是否已存在
+        """下载附件，按文件名查重；同一页的案件并发处理，同名附件按保存路径加锁串行"""
+        async with self._download_locks.setdefault(save_path, asyncio.Lock()):
+            # 检查文件是否已存在（只有完整下载后才会出现在目标路径）
             if os.path.exists(save_path):
                 logger.info(f"附件已存在，跳过下载: {save_path}")
                 return True
             
-            # 创建保存目录（如果不存在）
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            
-            # 下载文件
-            logger.info(f"开始下载附件: {url}")
-            response = self.session.get(url, stream=True, timeout=60)
-            response.raise_for_status()
-            
-            # 写入文件
-            with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            
-            logger.info(f"附件下载完成: {save_path}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"下载附件失败: {url}, 错误: {str(e)}")
-            if os.path.exists(save_path):
-                os.remove(save_path)
-            return False
+            # 先写入临时文件，完成后再原子替换到目标路径
+            tmp_path = f"{save_path}.part"
+            try:
+                # 创建保存目录（如果不存在）
+                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                
+                # 下载文件
+                logger.info(f"开始下载附件: {url}")
+                await self.rate_limiter.acquire()
+                async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=60)) as response:
+                    response.raise_for_status()
+                    
+                    # 以 1 MiB 分块写入文件，减少 Python 层循环次数
+                    with open(tmp_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                os.replace(tmp_path, save_path)
+                
+                logger.info(f"附件下载完成: {save_path}")
+                return True
+                
+            except Exception as e:
+                logger.error(f"下载附件失败: {url}, 错误: {str(e)}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return False
 
-    async def process_case(self, case):
-        """处理单个案件，包含查重和更新逻辑"""
+    async def process_case(self, case, existing_case=None):
+        """处理单个案件，包含查重和更新逻辑；existing_case 为本页预取的已有记录
+
+        Returns:
+            新案件返回 Case 对象，需更新的已有案件返回更新字典（含 id），其余返回 None；由 run() 按页批量写入
+        """
         try:
             case_title = case['title']
             case_url = case['url']
             
-            # 检查案件是否已存在
-            existing_case = self.db_session.query(Case).filter_by(case_name=case_title).first()
-            
             # 解析详情页
             detail_data = await self.parse_detail_page(case_url)
             if not detail_data:
                 logger.error(f"解析详情页失败: {case_url}")
-                return False
+                return None
             
             # 下载附件
             attachment_path = None
@@ -261,61 +300,49 @@ class ShanghaiScraper:
                         attachment_path = save_path
             
             if existing_case:
-                # 检查是否需要更新
-                need_update = False
+                # 只收集需要更新的字段
+                changes = {}
                 
                 # 检查日期是否为空
                 if not existing_case.notice_start_date and detail_data['start_date']:
-                    existing_case.notice_start_date = detail_data['start_date']
-                    need_update = True
+                    changes['notice_start_date'] = detail_data['start_date']
                 if not existing_case.notice_end_date and detail_data['end_date']:
-                    existing_case.notice_end_date = detail_data['end_date']
-                    need_update = True
+                    changes['notice_end_date'] = detail_data['end_date']
                 
                 # 检查地区是否为上海
                 if existing_case.region != '上海':
-                    existing_case.region = '上海'
-                    need_update = True
+                    changes['region'] = '上海'
                 
                 # 如果有新的附件路径，更新附件路径
                 if attachment_path and not existing_case.attachment_path:
-                    existing_case.attachment_path = attachment_path
-                    need_update = True
+                    changes['attachment_path'] = attachment_path
                 
-                if need_update:
-                    try:
-                        self.db_session.commit()
-                        logger.info(f"更新案件信息: {case_title}")
-                    except Exception as e:
-                        self.db_session.rollback()
-                        logger.error(f"更新案件失败: {case_title}, 错误: {str(e)}")
-                else:
-                    logger.info(f"案件已存在且无需更新: {case_title}")
-                return False
+                if changes:
+                    logger.info(f"更新案件信息: {case_title}")
+                    return dict(changes, id=existing_case.id)
+                logger.info(f"案件已存在且无需更新: {case_title}")
+                return None
             else:
                 # 创建新案件记录
-                try:
-                    new_case = Case(
-                        case_name=case_title,
-                        notice_start_date=detail_data['start_date'],
-                        notice_end_date=detail_data['end_date'],
-                        source_url=case_url,
-                        attachment_path=attachment_path,
-                        region='上海'
-                    )
-                    self.db_session.add(new_case)
-                    self.db_session.commit()
-                    logger.info(f"成功添加新案件: {case_title}")
-                    return True
-                    
-                except Exception as e:
-                    self.db_session.rollback()
-                    logger.error(f"添加新案件失败: {case_title}, 错误: {str(e)}")
-                    return False
+                new_case = Case(
+                    case_name=case_title,
+                    notice_start_date=detail_data['start_date'],
+                    notice_end_date=detail_data['end_date'],
+                    source_url=case_url,
+                    attachment_path=attachment_path,
+                    region='上海'
+                )
+                logger.info(f"添加新案件: {case_title}")
+                return new_case
 
         except Exception as e:
             logger.error(f"处理案件失败: {case.get('title', 'N/A')}, 错误: {str(e)}")
-            return False
+            return None
+
+    async def _process_case_bounded(self, case, existing_case):
+        """在信号量限制下处理单个案件"""
+        async with self.semaphore:
+            return await self.process_case(case, existing_case)
 
     async def run(self, max_page=None):
         """运行爬虫，增加最高页码限制"""
@@ -343,14 +370,38 @@ class ShanghaiScraper:
 
                 if cases:
                     logger.info(f"第 {current_page} 页找到 {len(cases)} 个案件")
-                    for case in cases:
-                        try:
-                            is_new = await self.process_case(case)
-                            if is_new:
-                                total_new_cases += 1
-                            await asyncio.sleep(0.5)  # 每个案件处理后短暂延迟
-                        except Exception as e:
-                            logger.error(f"处理案件失败: {case.get('title', 'N/A')}, 错误: {str(e)}")
+                    # 一次查询取出本页已存在的案件，避免逐个案件查库
+                    titles = [case['title'] for case in cases]
+                    existing_rows = self.db_session.execute(
+                        select(Case.id, Case.case_name, Case.notice_start_date, Case.notice_end_date, Case.region, Case.attachment_path)
+                        .where(Case.case_name.in_(titles))
+                    )
+                    by_name = {row.case_name: row for row in existing_rows}
+                    # 本页案件并发处理（并发数受信号量限制、请求速率受限速器限制）
+                    results = await asyncio.gather(
+                        *(self._process_case_bounded(case, by_name.get(case['title'])) for case in cases),
+                        return_exceptions=True
+                    )
+                    new_cases = {}
+                    updates = []
+                    for case, result in zip(cases, results):
+                        if isinstance(result, Exception):
+                            logger.error(f"处理案件失败: {case.get('title', 'N/A')}, 错误: {str(result)}")
+                        elif isinstance(result, Case):
+                            new_cases[result.case_name] = result  # 同一页重名案件只插入一次
+                        elif result:
+                            updates.append(result)
+                    # 整页批量插入、批量更新，只提交一次
+                    try:
+                        if new_cases:
+                            self.db_session.bulk_save_objects(list(new_cases.values()))
+                        if updates:
+                            self.db_session.bulk_update_mappings(Case, updates)
+                        self.db_session.commit()
+                        total_new_cases += len(new_cases)
+                    except Exception as e:
+                        self.db_session.rollback()
+                        logger.error(f"第 {current_page} 页提交数据库失败: {str(e)}")
                 else:
                     logger.warning(f"第 {current_page} 页未找到案件")
                 
@@ -405,20 +456,21 @@ class ShanghaiScraper:
             if os.path.exists(excel_path):
                 existing_df = pd.read_excel(excel_path)
                 
-                # 合并数据，保留最新的记录
-                combined_df = pd.concat([existing_df, current_df])
-                combined_df = combined_df.drop_duplicates(subset=['案件名称'], keep='last')
+                # 按案件名称合并：以数据库记录为准，数据库中为空的字段用Excel原值补齐
+                cur = current_df.drop_duplicates(subset=['案件名称'], keep='last').set_index('案件名称')
+                old = existing_df.drop_duplicates(subset=['案件名称'], keep='last').set_index('案件名称')
+                combined_df = cur.combine_first(old).reset_index()
                 
                 # 按日期排序
                 combined_df.sort_values(by=['公示开始日期'], ascending=False, inplace=True)
                 
                 # 保存到Excel
-                combined_df.to_excel(excel_path, index=False)
+                write_excel(combined_df, excel_path)
                 logger.info(f"更新Excel文件完成，总记录数: {len(combined_df)}")
                 return {'total_cases': len(combined_df)}
             else:
                 # 创建新的Excel文件
-                current_df.to_excel(excel_path, index=False)
+                write_excel(current_df, excel_path)
                 logger.info(f"创建新Excel文件完成，总记录数: {len(current_df)}")
                 return {'total_cases': len(current_df)}
             
@@ -432,8 +484,11 @@ if __name__ == "__main__":
     warnings.filterwarnings("ignore")
     urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
     
-    scraper = ShanghaiScraper()
+    async def main():
+        async with ShanghaiScraper() as scraper:
+            await scraper.run(max_page=6)
+
     # 运行爬虫，设置最高页码为 6
     logger.info("开始运行上海爬虫，限制页码为 6 页...")
-    asyncio.run(scraper.run(max_page=6))
+    asyncio.run(main())
     logger.info("爬虫运行结束（限制 6 页）。")
@@ -1,90 +1,203 @@
 import re
 from config import CONFIG
 from datetime import datetime
+import functools
+import logging
 import os
+import numpy as np
+import pandas as pd
+from urllib.parse import urlsplit
 
-class DateParser:
-    @staticmethod
-    def parse_date_string(date_str):
-        """解析各种格式的日期字符串"""
+try:
+    import ciso8601
+    _parse_iso = ciso8601.parse_datetime_as_naive
+except ImportError:
+    _parse_iso = None
+
+logger = logging.getLogger(__name__)
+
+# 中文年月日一次性替换为 '-' 分隔
+_CJK_TABLE = str.maketrans({'年': '-', '月': '-', '日': ''})
+
+# 文件名非法字符统一替换为下划线
+_FN_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+
+# 本进程内已确认存在的目录，避免重复 makedirs
+_DIR_CACHE = set()
+
+# 支持的附件扩展名
+_EXT_SET = frozenset(('.doc', '.docx', '.pdf'))
+
+# 日期范围：起止两个日期用 '至' 连接
+_RANGE_RE = re.compile(r'(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)\s*至\s*(\d{4}[-年]\d{1,2}[-月]\d{1,2}日?)')
+
+# 常见日期格式预编译为单个正则：YYYY-MM-DD[ HH:MM:SS] 或 YYYYMMDD
+_DATE_RE = re.compile(
+    r'^(?:(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})'
+    r'(?:[ T](?P<H>\d{1,2}):(?P<M>\d{1,2}):(?P<S>\d{1,2}))?'
+    r'|(?P<y2>\d{4})(?P<m2>\d{2})(?P<d2>\d{2}))$'
+)
+
+# 正则未命中时的兜底格式
+_DATE_FORMATS = (
+    '%Y-%m-%d',  # 2025-03-20
+    '%Y-%m-%d %H:%M:%S',  # 2025-03-20 12:00:00
+    '%Y%m%d',  # 20250320
+)
+
+@functools.lru_cache(maxsize=128)
+def _compiled(pattern):
+    """编译并缓存字符串形式的正则"""
+    return re.compile(pattern)
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date_cached(date_str):
+    """解析日期字符串并缓存结果（各页面常出现相同的日期）"""
+    if not isinstance(date_str, str) or not date_str:
+        return None
+
+    # 移除首尾空格并标准化年月日格式
+    date_str = date_str.strip().translate(_CJK_TABLE)
+    # 年月日替换后应只剩 ASCII；全角等非 ASCII 数字 isdigit() 也为真，这里直接拒绝
+    if not date_str.isascii():
+        return None
+    
+    # 按长度直接切片构造主流格式：10=YYYY-MM-DD，8=YYYYMMDD，19=YYYY-MM-DD HH:MM:SS
+    # 形状确认后的 ISO 串有 ciso8601（C 实现）时交给它，结果与切片构造一致
+    # 切片先校验全为数字（int() 会接受 '+025'、'2_25' 这类写法），分隔符位置也须吻合
+    n = len(date_str)
+    try:
+        if (n == 10 and date_str[4] == '-' and date_str[7] == '-'
+                and date_str[0:4].isdigit() and date_str[5:7].isdigit() and date_str[8:10].isdigit()):
+            if _parse_iso is not None:
+                return _parse_iso(date_str)
+            return datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]))
+        if n == 8 and date_str.isdigit():
+            return datetime(int(date_str[0:4]), int(date_str[4:6]), int(date_str[6:8]))
+        if (n == 19 and date_str[4] == '-' and date_str[7] == '-' and date_str[10] in ' T'
+                and date_str[13] == ':' and date_str[16] == ':'
+                and date_str[0:4].isdigit() and date_str[5:7].isdigit() and date_str[8:10].isdigit()
+                and date_str[11:13].isdigit() and date_str[14:16].isdigit() and date_str[17:19].isdigit()):
+            if _parse_iso is not None:
+                return _parse_iso(date_str)
+            return datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]),
+                            int(date_str[11:13]), int(date_str[14:16]), int(date_str[17:19]))
+    except ValueError:
+        # 形如 2025-13-01 的非法日期
+        return None
+    
+    # 其余形式（如 2025-3-5）再用预编译正则直接构造 datetime，避免逐个格式 strptime 抛异常
+    m = _DATE_RE.match(date_str)
+    if m is not None:
         try:
-            # 移除所有空格
-            date_str = date_str.strip()
-            
-            # 标准化年月日格式
-            date_str = date_str.replace('年', '-').replace('月', '-').replace('日', '')
-            
-            # 尝试不同的日期格式
-            formats = [
-                '%Y-%m-%d',  # 2025-03-20
-                '%Y-%m-%d %H:%M:%S',  # 2025-03-20 12:00:00
-                '%Y%m%d',  # 20250320
-            ]
-            
-            for fmt in formats:
-                try:
-                    return datetime.strptime(date_str, fmt)
-                except ValueError:
-                    continue
-                    
+            if m.group('y2') is not None:
+                return datetime(int(m.group('y2')), int(m.group('m2')), int(m.group('d2')))
+            if m.group('H') is not None:
+                return datetime(int(m.group('y')), int(m.group('m')), int(m.group('d')),
+                                int(m.group('H')), int(m.group('M')), int(m.group('S')))
+            return datetime(int(m.group('y')), int(m.group('m')), int(m.group('d')))
+        except ValueError:
+            # 形如 2025-13-01 的非法日期
             return None
+    
+    # 兜底：尝试不同的日期格式
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
             
-        except Exception:
-            return None
+    return None
+
+@functools.lru_cache(maxsize=1024)
+def _sanitize_cached(filename):
+    """清理文件名并缓存结果（重试/翻页时常生成相同的文件名）"""
+    # 移除或替换非法字符
+    return filename.translate(_FN_TABLE).strip()[:255]  # 限制文件名长度
+
+class DateParser:
+    # 解析各种格式的日期字符串（直接复用模块级缓存函数）
+    parse_date_string = staticmethod(_parse_date_cached)
+
+    @staticmethod
+    def parse_many(date_strs):
+        """批量解析日期字符串，返回 numpy datetime64 数组，无法解析的为 NaT（时间精度由 pandas 版本决定）"""
+        cleaned = [s.strip().translate(_CJK_TABLE) if isinstance(s, str) else None for s in date_strs]
+        # 全部为 YYYYMMDD 时直接在 numpy 中按位拆出年月日
+        if cleaned and all(s is not None and len(s) == 8 for s in cleaned):
+            joined = ''.join(cleaned)
+            if joined.isascii() and joined.isdigit():
+                digits = np.frombuffer(joined.encode('ascii'), dtype=np.uint8).reshape(-1, 8).astype(np.int32) - ord('0')
+                parts = pd.DataFrame({
+                    'year': digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3],
+                    'month': digits[:, 4] * 10 + digits[:, 5],
+                    'day': digits[:, 6] * 10 + digits[:, 7],
+                })
+                return pd.to_datetime(parts, errors='coerce').to_numpy()
+        return pd.to_datetime(cleaned, format='ISO8601', errors='coerce').to_numpy()
 
     @staticmethod
     def extract_date_range(text, pattern=None):
-        """从文本中提取日期范围"""
-        try:
-            if pattern:
-                match = re.search(pattern, text)
-                if match:
-                    date_range = match.group(1)
-            else:
-                date_range = text
-                
-            if '至' in date_range:
-                start_date, end_date = date_range.split('至')
-                return (
-                    DateParser.parse_date_string(start_date.strip()),
-                    DateParser.parse_date_string(end_date.strip())
-                )
-        except Exception as e:
-            print(f"解析日期范围失败: {e}")
-            pass
+        """从文本中提取日期范围
+
+        pattern 可以是字符串或预编译的 re.Pattern；调用方最好在模块级 re.compile 后传入。
+        pattern 的第 1 个分组为日期范围文本。text 不是字符串、pattern 未匹配或没有分组时返回 (None, None)。
+        """
+        if not isinstance(text, str):
+            return None, None
+        if pattern:
+            pat = pattern if hasattr(pattern, 'search') else _compiled(pattern)
+            match = pat.search(text)
+            if not match or pat.groups < 1:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("未匹配到日期范围: %s", text)
+                return None, None
+            date_range = match.group(1)
+            if date_range is None:
+                return None, None
+        else:
+            date_range = text
+
+        # 一次正则同时捕获起止日期
+        m = _RANGE_RE.search(date_range)
+        if m:
+            return _parse_date_cached(m.group(1)), _parse_date_cached(m.group(2))
+
+        # 其他格式（如 YYYYMMDD 或带时间）按 '至' 拆分
+        start_date, sep, end_date = date_range.partition('至')
+        if sep:
+            return _parse_date_cached(start_date), _parse_date_cached(end_date)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("解析日期范围失败: %s", date_range)
         return None, None
 
+    # 页面类型到解析方法名的映射
+    PARSER_MAP = {
+        'samr': 'parse_samr_page',
+        'beijing': 'parse_beijing_page',
+        'chongqing': 'parse_chongqing_page',
+        'shanghai': 'parse_shanghai_page',
+        'guangdong': 'parse_guangdong_page'
+    }
+
     @staticmethod
     def get_parser_for_type(page_type):
         """根据页面类型返回对应的解析方法名"""
-        parser_map = {
-            'samr': 'parse_samr_page',
-            'beijing': 'parse_beijing_page',
-            'chongqing': 'parse_chongqing_page',
-            'shanghai': 'parse_shanghai_page',
-            'guangdong': 'parse_guangdong_page'
-        }
-        return parser_map.get(page_type)
+        return DateParser.PARSER_MAP.get(page_type)
 
 class FileHandler:
-    @staticmethod
-    def sanitize_filename(filename):
-        """
-        清理文件名中的非法字符
-        """
-        # 移除或替换非法字符
-        invalid_chars = '<>:"/\\|?*'
-        for char in invalid_chars:
-            filename = filename.replace(char, '_')
-        return filename.strip()[:255]  # 限制文件名长度
+    # 清理文件名中的非法字符（直接复用模块级缓存函数）
+    sanitize_filename = staticmethod(_sanitize_cached)
 
     @staticmethod
     def ensure_directory(path):
         """
         确保目录存在
         """
-        if not os.path.exists(path):
-            os.makedirs(path)
+        if path in _DIR_CACHE:
+            return path
+        os.makedirs(path, exist_ok=True)
+        _DIR_CACHE.add(path)
         return path
 
     @staticmethod
@@ -92,11 +205,9 @@ class FileHandler:
         """
         从URL中获取文件扩展名
         """
-        extensions = ['.doc', '.docx', '.pdf']
-        for ext in extensions:
-            if url.lower().endswith(ext):
-                return ext
-        return '.doc'  # 默认扩展名
+        # 去掉查询串后只取一次后缀
+        ext = os.path.splitext(url.partition('?')[0])[1].lower()
+        return ext if ext in _EXT_SET else '.doc'  # 默认扩展名
 
 class PageTypeIdentifier:
     # 页面类型到地区的映射
@@ -109,21 +220,29 @@ class PageTypeIdentifier:
         'shaanxi': '陕西'
     }
 
+    # 域名到页面类型的映射，按完整域名（含其子域名）匹配；CaseScraper 也使用这张表
+    DOMAIN_MAP = {
+        'samr.gov.cn': 'samr',
+        'scjgj.beijing.gov.cn': 'beijing',
+        'scjgj.cq.gov.cn': 'chongqing',
+        'scjgj.sh.gov.cn': 'shanghai',
+        'amr.gd.gov.cn': 'guangdong',
+        'snamr.shaanxi.gov.cn': 'shaanxi',
+        'scjgj.shaanxi.gov.cn': 'shaanxi'
+    }
+
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def identify_page_type(url):
         """识别页面类型"""
-        if 'samr.gov.cn' in url:
-            return 'samr'
-        elif 'scjgj.beijing.gov.cn' in url:
-            return 'beijing'
-        elif 'scjgj.cq.gov.cn' in url:
-            return 'chongqing'
-        elif 'scjgj.sh.gov.cn' in url:
-            return 'shanghai'
-        elif 'amr.gd.gov.cn' in url:
-            return 'guangdong'
-        elif 'snamr.shaanxi.gov.cn' in url:
-            return 'shaanxi'
+        # 按主机名逐级去掉最左侧的子域名查表，如 www.samr.gov.cn -> samr.gov.cn
+        host = urlsplit(url).hostname or ''
+        domain_map = PageTypeIdentifier.DOMAIN_MAP
+        while host:
+            page_type = domain_map.get(host)
+            if page_type is not None:
+                return page_type
+            host = host.partition('.')[2]
         return None
 
     @staticmethod